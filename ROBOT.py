@@ -80,12 +80,16 @@ class Bot(commands.Bot):
         self.embed_color = embed_color
         self.webhook_id = webhook_id
         self.prefixes = prefixes
+        self.config = config.__dict__
         self.db = Database(self)
         self.db_path = db_path
-        self.config = config.__dict__
         self.renderer = None
         self.flags = None
+        self.attachment_cache = None
         self.variants = None
+        self.tile_variants = None
+        self.sign_variants = None
+        self.variant_names = []
         self.palette_cache = {}
         self.macros = {}
         self.baba_loaded = True
@@ -0,0 +1,142 @@
+"""Times compositing layers in batched passes against the tile-by-tile loop it replaced.
+
+Run from the repository root with `python -m bench.composite`. Every scene is also composited by the loop that
+`Renderer.render` used to run, and both are checked to give exactly the same frames.
+"""
+import functools
+import time
+
+import numpy as np
+
+import config
+from src import constants
+from src.cogs.render import Renderer, get_first_frame
+from src.tile import ProcessedTile
+from src.types import RenderContext
+
+
+def tile_by_tile(renderer, steps, grid, ctx, frames, animation_timestep, default_size, origin):
+    """Blends every tile onto the frames one at a time, like `Renderer.render` used to."""
+    top, left = origin
+    for t, step in enumerate(grid):
+        for z, layer in enumerate(step):
+            for y, row in enumerate(layer):
+                for x, tile in enumerate(row):
+                    first_frame = get_first_frame(tile)
+                    if tile.empty:
+                        continue
+                    displacement = (
+                        y * ctx.spacing - int((first_frame[0] - ctx.spacing) / 2) + top - tile.displacement[1],
+                        x * ctx.spacing - int((first_frame[1] - ctx.spacing) / 2) + left - tile.displacement[0])
+                    for i, frame in enumerate(frames[animation_timestep * t:animation_timestep * (t + 1)]):
+                        image_index = i + animation_timestep * t
+                        wobble = tile.wobble_frames[
+                            min(len(tile.wobble_frames) - 1, frame - 1)] if tile.wobble_frames is not None \
+                            else (11 * x + 13 * y + frame - 1) % 3 if ctx.random_animations \
+                            else frame - 1
+                        final_wobble = functools.reduce(lambda a, b: a if b is None else b, tile.frames)
+                        image = tile.frames[wobble] if tile.frames[wobble] is not None else final_wobble
+                        dslice = (default_size - (first_frame + displacement))
+                        dst_slice = (
+                            slice(max(-displacement[0], 0), dslice[0] if dslice[0] < 0 else None),
+                            slice(max(-displacement[1], 0), dslice[1] if dslice[1] < 0 else None)
+                        )
+                        image = image[*dst_slice]
+                        if image.size < 1:
+                            continue
+                        src_slice = (
+                            slice(max(displacement[0], 0), image.shape[0] + max(displacement[0], 0)),
+                            slice(max(displacement[1], 0), image.shape[1] + max(displacement[1], 0))
+                        )
+                        index = image_index, *src_slice
+                        try:
+                            steps[index] = renderer.blend(tile.blending, steps[index], image, tile.keep_alpha)
+                        except IndexError:
+                            pass
+
+
+def batched(renderer, steps, grid, ctx, frames, animation_timestep, default_size, origin):
+    """Blends each layer onto the frames in passes, like `Renderer.composite_frames` does."""
+    for t, step in enumerate(grid):
+        timestep_frames = frames[animation_timestep * t:animation_timestep * (t + 1)]
+        for layer in step:
+            renderer.composite_layer(steps[animation_timestep * t:animation_timestep * (t + 1)], layer,
+                                     timestep_frames, ctx, origin)
+
+
+def scene(rng, timesteps: int, depth: int, height: int, width: int, modes: tuple[str, ...],
+          big: float = 0.0, displaced: float = 0.0):
+    """Makes a grid of random tiles, some of them empty, bigger than a cell or displaced."""
+    grid = []
+    for _ in range(timesteps):
+        layers = []
+        for _ in range(depth):
+            layer = []
+            for _ in range(height):
+                row = []
+                for _ in range(width):
+                    if rng.random() < 0.2:
+                        row.append(ProcessedTile())
+                        continue
+                    size = constants.DEFAULT_SPRITE_SIZE * (2 if rng.random() < big else 1)
+                    # Like game sprites, these only use a few colors, and are mostly opaque or clear
+                    palette = rng.integers(0, 256, (6, 4), dtype=np.uint8)
+                    palette[:, 3] = (0, 255, 255, 255, 255, 128)
+                    frames = list(palette[rng.choice(6, (3, size, size), p=(0.4, 0.2, 0.15, 0.1, 0.1, 0.05))])
+                    mode = str(rng.choice(modes))
+                    # xor can't blend without keeping the alpha, in either implementation
+                    tile = ProcessedTile(empty=False, frames=frames, blending=mode,
+                                         keep_alpha=mode == "xor" or bool(rng.random() < 0.8))
+                    if rng.random() < displaced:
+                        tile.displacement = [int(rng.integers(-12, 12)), int(rng.integers(-12, 12))]
+                    row.append(tile)
+                layer.append(row)
+            layers.append(layer)
+        grid.append(layers)
+    return grid
+
+
+# Timesteps, layers, height, width, blending modes, share of big tiles, share of displaced tiles
+SCENES = {
+    "level": (1, 2, 18, 33, ("normal",), 0.0, 0.0),
+    "large": (1, 1, 40, 60, ("normal",), 0.0, 0.0),
+    "stacked": (1, 6, 10, 10, ("normal",), 0.1, 0.3),
+    "blending": (1, 2, 12, 16, tuple(constants.BLENDING_MODES), 0.3, 0.3),
+    "animated": (3, 2, 10, 14, ("normal", "add", "multiply"), 0.1, 0.2),
+}
+
+
+class Bot:
+    config = config.__dict__
+
+
+def main(repeats: int = 3):
+    renderer = Renderer(Bot)
+    ctx = RenderContext()
+    print(f"{'scene':<12}{'tiles':>8}{'tile-by-tile':>16}{'batched':>12}{'speedup':>10}")
+    for name, (timesteps, *shape, modes, big, displaced) in SCENES.items():
+        grid = scene(np.random.default_rng(len(name)), timesteps, *shape, modes, big, displaced)
+        depth, height, width = shape
+        frames = list(ctx.frames) * timesteps
+        # Leave a margin for the big and displaced tiles, like `Renderer.render` does
+        margin = constants.DEFAULT_SPRITE_SIZE
+        default_size = np.array((height * ctx.spacing + 2 * margin, width * ctx.spacing + 2 * margin))
+        timings = [0.0, 0.0]
+        outputs = []
+        for i, composite in enumerate((tile_by_tile, batched)):
+            for _ in range(repeats):
+                steps = np.zeros((len(frames), *default_size, 4), dtype=np.uint8)
+                start = time.perf_counter()
+                with np.errstate(all="ignore"):
+                    composite(renderer, steps, grid, ctx, frames, len(ctx.frames), default_size, (margin, margin))
+                timings[i] += (time.perf_counter() - start) / repeats
+            outputs.append(steps)
+        assert np.array_equal(*outputs), f"The frames of {name} differ."
+        tiles = sum(not tile.empty for step in grid for layer in step for row in layer for tile in row)
+        print(f"{name:<12}{tiles:>8}{timings[0] * 1000:>14.1f}ms{timings[1] * 1000:>10.1f}ms"
+              f"{timings[0] / timings[1]:>9.1f}x")
+    renderer.pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
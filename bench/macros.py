@@ -0,0 +1,76 @@
+"""Times the macro evaluator on a corpus of macros taken from the macro docs and scenes built out of them.
+
+Run from the repository root with `python -m bench.macros`. Each input is also evaluated by searching the whole
+string again after every step, which is how macros used to be evaluated, and both results are checked to match.
+"""
+import re
+import time
+
+from src import constants, errors
+from src.cogs.macros import MacroCog, MacroTrace
+from src.types import Macro
+
+MACROS = {
+    "bug": Macro("rot$1:rot-$1", "", 0),
+    "limbo_r": Macro(":disp5/0>:disp10/0>:disp14/0>:disp19/0>:disp24/0>:disp29/0>:disp34/0>:disp38/0>"
+                     ":disp43/0>:disp48/0>", "", 0),
+    "co": Macro("[$1color]", "", 0),
+    "tiffcolor": Macro("c#ff8080", "", 0),
+    "double": Macro("[multiply/$1/2]", "", 0),
+    "hsv": Macro("hs[multiply/$1/30]:sat[divide/$2/10]", "", 0),
+}
+
+CORPUS = {
+    "arithmetic": "[multiply/6/[add/3/4]]",
+    "variables": "[store/x/3][store/y/14][multiply/[load/x]/[load/y]]",
+    "defaults": "[store/x/2]...[get/x/1]...[load/x]",
+    "try": "[try/\\[add/1/\\[nope\\]\\]]",
+    "row": " ".join(f"baba:m!bug/{i * 15}:[co/tiff]" for i in range(24)),
+    "scene": "\n".join(
+        " ".join(f"keke:hs[add/{x}/[multiply/{y}/12]]:[double/{x + y}]" for x in range(16)) for y in range(16)
+    ),
+    "timeline": " ".join("key[limbo_r]" for _ in range(48)),
+    "generated": "[unescape/[repeat/100/\\[double\\/\\[add\\/1\\/2\\]\\] ]]",
+    "escapes": " ".join(f"text_\\[{i}\\]:[hsv/{i}/{i % 10}]" for i in range(64)),
+}
+
+OLD_PATTERN = re.compile(r"(?<!(?<!\\)\\)\[((?:\\[\[\]])?(?:[^\[\]]|(?:[^\\]\\[\[\]]))*?(?<!(?<!\\)\\))]", re.M)
+
+
+def rescan(handler: MacroCog, objects: str) -> str:
+    """Evaluates macros by searching the whole string again after every step."""
+    handler.debug, handler.variables, handler.found = MacroTrace(), {}, 0
+    while match := OLD_PATTERN.search(objects):
+        handler.found += 1
+        assert handler.found <= constants.MACRO_LIMIT
+        objects = objects[:match.start()] + handler.parse_term_macro(match.group(1), MACROS, handler.found) + \
+            objects[match.end():]
+    return objects
+
+
+class Bot:
+    macros = MACROS
+
+
+def main(repeats: int = 20):
+    handler = MacroCog(Bot())
+    print(f"{'input':<12}{'length':>8}{'rescanning':>14}{'single pass':>14}{'speedup':>10}")
+    for name, objects in CORPUS.items():
+        timings = []
+        outputs = []
+        for evaluate in (lambda: rescan(handler, objects), lambda: handler.parse_macros(objects, False, MACROS)[0]):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                try:
+                    output = evaluate()
+                except (AssertionError, errors.FailedBuiltinMacro) as err:
+                    output = repr(err)
+            timings.append((time.perf_counter() - start) / repeats)
+            outputs.append(output)
+        assert outputs[0] == outputs[1], f"The outputs for {name} differ."
+        print(f"{name:<12}{len(objects):>8}{timings[0] * 1000:>12.2f}ms{timings[1] * 1000:>12.2f}ms"
+              f"{timings[0] / timings[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Times the variants that used to loop over pixels in Python against the loops they replaced.
+
+Run from the repository root with `python -m bench.variants`. Every variant is also checked to give exactly the same
+sprite as its old implementation, on sprites up to the sizes that scaling or padding beforehand can make them.
+"""
+import asyncio
+import importlib
+import time
+
+import numpy as np
+
+from src.cogs import variants
+
+# The package exports the liquify function under the module's name
+liquify = importlib.import_module("src.cogs.liquify.liquify")
+
+
+async def omni(sprite, type="branching", wobble=0):
+    opvalue = [0xcb, 0xab, 0x8b][wobble]
+    num = 1 if type == "pivot" else 3
+    nsprite = await Bot.variants.parse(f"meta/{num}").apply(sprite)
+    sprite = await Bot.variants.parse(f"pad/{num}/{num}/{num}/{num}").apply(sprite)
+    for i in range(nsprite.shape[0]):
+        for j in range(nsprite.shape[1]):
+            if nsprite[i, j, 3] == 0:
+                nsprite[i, j] = sprite[i, j]
+            else:
+                nsprite[i, j, 3] = opvalue
+    return nsprite
+
+
+async def melt(sprite, side="bottom"):
+    is_vertical = side in ("top", "bottom")
+    at_end = side in ("right", "bottom")
+    if is_vertical:
+        sprite = np.swapaxes(sprite, 0, 1)
+    for i in range(sprite.shape[0]):
+        sprite_slice = sprite[i, sprite[i, :, 3] != 0]
+        sprite[i] = np.pad(sprite_slice,
+                           ((sprite[i].shape[0] - sprite_slice.shape[0], 0)[::2 * at_end - 1], (0, 0)))
+    if is_vertical:
+        sprite = np.swapaxes(sprite, 0, 1)
+    return sprite
+
+
+async def wave(sprite, axis, amplitude, offset, frequency):
+    if axis == "y":
+        sprite = np.rot90(sprite)
+    offset = ((np.sin(
+        np.linspace(offset, np.pi * 2 * (frequency + offset), sprite.shape[0])) / 2) * amplitude).astype(int)
+    for row in range(sprite.shape[0]):
+        sprite[row] = np.roll(sprite[row], offset[row], axis=0)
+    if axis == "y":
+        sprite = np.rot90(sprite, -1)
+    return sprite
+
+
+def most_used_color(img):
+    color, count = [0, 0, 0, 0], 0
+    for candidate in liquify.get_colors(img):
+        instances = liquify.count_instances_of_color(img, candidate)
+        if instances > count:
+            color, count = candidate, instances
+    return color, count
+
+
+async def liquify_variant(sprite):
+    color, count = most_used_color(sprite)
+    sprite = liquify.remove_instances_of_color(sprite, color).swapaxes(0, 1)
+    for i in range(len(sprite)):
+        sprite[i] = np.array(sorted(sprite[i], key=lambda y: int(y[3] != 0)))
+    return liquify.colorflood(sprite.swapaxes(0, 1), color, count)
+
+
+CASES = {
+    "branching": omni,
+    "pivot": lambda sprite: omni(sprite, "pivot", 2),
+    "melt": melt,
+    "melt/left": lambda sprite: melt(sprite, "left"),
+    "wave/x/4/0.5/1.5": lambda sprite: wave(sprite, "x", 4, 0.5, 1.5),
+    "wave/y/-7/2/0.3": lambda sprite: wave(sprite, "y", -7, 2, 0.3),
+    "liquify": liquify_variant,
+}
+
+
+class Bot:
+    variants = None
+
+
+def sprites(size: int, count: int = 4):
+    rng = np.random.default_rng(size)
+    for _ in range(count):
+        # Like game sprites, these only use a few colors, some of them more than others
+        palette = rng.integers(0, 256, (8, 4), dtype=np.uint8)
+        palette[:, 3] = 255
+        palette[0] = 0
+        yield palette[rng.choice(8, (size, size), p=(0.5, 0.2, 0.1, 0.05, 0.05, 0.05, 0.03, 0.02))]
+
+
+async def main(repeats: int = 3):
+    await variants.setup(Bot)
+    Bot.variants = Bot.tile_variants
+    print(f"{'variant':<20}{'size':>6}{'loop':>12}{'vectorized':>14}{'speedup':>10}")
+    for name, reference in CASES.items():
+        variant = Bot.variants.parse(name)
+        for size in (24, 96, 240):
+            timings = [0.0, 0.0]
+            for sprite in sprites(size):
+                outputs = []
+                for i, evaluate in enumerate((
+                        lambda: reference(sprite.copy()),
+                        lambda: variant.apply(sprite.copy(), tile=None, wobble=2 if name == "pivot" else 0,
+                                              renderer=None))):
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        output = await evaluate()
+                    timings[i] += (time.perf_counter() - start) / repeats
+                    outputs.append(output)
+                assert outputs[0].shape == outputs[1].shape and (outputs[0] == outputs[1]).all(), \
+                    f"The outputs of {name} differ for a {size}x{size} sprite."
+            print(f"{name:<20}{size:>6}{timings[0] * 1000:>10.2f}ms{timings[1] * 1000:>12.2f}ms"
+                  f"{timings[0] / timings[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
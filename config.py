@@ -27,4 +27,25 @@ cogs = [
 ]
 danger_mode = False
 debug = False
+# Number of threads that compositing and encoding are offloaded to
+render_workers = 4
+# Maximum size in bytes of the decoded sprites kept in memory between renders
+sprite_cache_budget = 256 * 2 ** 20
+# Memory-mapped sprites, built with `python -m src.sprites` or the buildpack command
+sprite_pack = "data/sprites.pack"
+# Maximum size in bytes of the processed tiles kept in memory between renders
+tile_cache_budget = 128 * 2 ** 20
+# If set, processed tiles are also saved to this directory
+tile_cache_dir = None
+# Finished renders are cached here, so that repeated requests are served without rendering
+render_cache_dir = "target/render_cache"
+render_cache_budget = 512 * 2 ** 20
+# Maximum size in bytes of the generated custom text sprites kept in memory
+text_cache_budget = 32 * 2 ** 20
+# Maximum size in bytes of the decoded filter images kept in memory
+filter_cache_budget = 64 * 2 ** 20
+# Downloaded filter images are kept here, and revalidated with the server before they're reused
+filter_cache_dir = "target/filter_cache"
+# Maximum size in bytes of the decoded images kept in memory for --combine and --combine-background
+attachment_cache_budget = 64 * 2 ** 20
 owner_only_mode = [False,'']
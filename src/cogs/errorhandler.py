@@ -3,7 +3,6 @@ from __future__ import annotations
 import asyncio
 import os
 import re
-import signal
 import sqlite3
 import sys
 import traceback
@@ -11,7 +10,6 @@ import numpy
 
 import discord
 from discord.ext import commands
-import requests
 
 import webhooks
 from ..types import Bot, Context
@@ -188,8 +186,6 @@ class CommandErrorHandler(commands.Cog):
 
             elif isinstance(error, numpy.linalg.LinAlgError):
                 return await ctx.error("The given warp points are unsolvable.")
-            elif isinstance(error, requests.exceptions.ConnectionError):
-                return await ctx.error('A given link for the filterimage was invalid.')
             elif isinstance(error, errors.OverlayNotFound):
                 return await ctx.error(f'The overlay `{error}` does not exist.')
             elif isinstance(error, asyncio.exceptions.TimeoutError):
@@ -285,8 +281,6 @@ class CommandErrorHandler(commands.Cog):
                 return
             except:
                 await ctx.error(msg="Error handler fatally errored. Contact the bot owner as soon as possible.")
-        finally:
-            signal.alarm(0)
 
 
 async def setup(bot: Bot):
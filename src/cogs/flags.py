@@ -1,16 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import random
 import re
+import time
+from io import BytesIO
 from os import listdir
 from typing import TYPE_CHECKING
+import aiohttp
 import discord
 
-import requests
 from PIL import Image
 
 from .. import constants
 from ..errors import InvalidFlagError
+from ..sprites import LRUCache
 from ..tile import Tile
 from ..types import Color, Macro, RenderContext
 
@@ -87,22 +91,54 @@ async def find_message(ctx):
     finally:
         assert msg is not None, f'None of your commands were found in the last `{constants.MESSAGE_LIMIT}` messages.'
         if do_finally:
-            # try:
-            assert int(
-                requests.head(msg.attachments[0].url, stream=True)
-                .headers.get('content-length', 0)) <= constants.COMBINE_MAX_FILESIZE, \
-                f'Prepended image too large! Max filesize is `{constants.COMBINE_MAX_FILESIZE}` bytes.'
-            with Image.open(requests.get(msg.attachments[0].url, stream=True).raw) as im:
-                out = []
-                for frame in range(im.n_frames):
-                    im.seek(frame)
-                    out.append(im.copy())
-                return tuple(out)
+            return await load_attachment(ctx.bot, msg.attachments[0])
+
+
+def decode_frames(buffer: bytes) -> tuple[Image.Image, ...]:
+    with Image.open(BytesIO(buffer)) as im:
+        out = []
+        for frame in range(getattr(im, "n_frames", 1)):
+            im.seek(frame)
+            out.append(im.copy())
+        return tuple(out)
+
+
+async def load_attachment(bot: Bot, attachment: discord.Attachment) -> tuple[Image.Image, ...]:
+    """Downloads and decodes every frame of an attachment.
+
+    Frames are kept for a while, so that chains of renders replying to each other don't load the same image again.
+    """
+    url = attachment.url
+    cached = bot.attachment_cache.lookup(url)
+    if cached is not None:
+        expiry, frames = cached
+        if time.monotonic() < expiry:
+            return frames
+        bot.attachment_cache.discard(url)
+    too_large = f'Prepended image too large! Max filesize is `{constants.COMBINE_MAX_FILESIZE}` bytes.'
+    assert attachment.size <= constants.COMBINE_MAX_FILESIZE, too_large
+    try:
+        async with bot.db.session.get(url) as resp:
+            resp.raise_for_status()
+            buffer = bytearray()
+            async for chunk in resp.content.iter_chunked(2 ** 16):
+                buffer += chunk
+                assert len(buffer) <= constants.COMBINE_MAX_FILESIZE, too_large
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        raise AssertionError("The image to combine with couldn't be downloaded!")
+    try:
+        frames = await asyncio.to_thread(decode_frames, bytes(buffer))
+    except IOError:
+        raise AssertionError("The image to combine with couldn't be parsed!")
+    nbytes = sum(frame.width * frame.height * len(frame.getbands()) for frame in frames)
+    bot.attachment_cache.store(url, (time.monotonic() + constants.ATTACHMENT_CACHE_TTL, frames), nbytes)
+    return frames
 
 
 async def setup(bot: Bot):
     flags = Flags()
     bot.flags = flags
+    bot.attachment_cache = LRUCache(bot.config["attachment_cache_budget"])
 
     @flags.register(match=r"(?:--background|-b)(?:=("
                           rf"(?:#(?:[0-9A-Fa-f]{{2}}){{3,4}})|"
@@ -1,15 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 import collections
+import functools
 import os
-import signal
 import time
 import traceback
 import warnings
 from pathlib import Path
 
-import requests
-
 import math
 from PIL import Image
 import re
@@ -32,10 +31,11 @@ import webhooks
 from src.types import SignText, RenderContext
 from src.utils import ButtonPages
 from ..tile import Tile, TileSkeleton, parse_variants
+from ..workers import RenderJob, interrupt_after
 
 from .. import constants, errors
 from ..db import CustomLevelData, LevelData
-from ..types import Bot, Context, RegexDict
+from ..types import Bot, Context
 
 
 def try_index(string: str, value: str) -> int:
@@ -146,7 +146,7 @@ class RenderBox(ui.Modal, title='Render Body'):
         wrapper.message.content = self.scene.value
         wrapper.bot = self.bot
         wrapper.fake = True
-        await self.global_cog.render_tiles(
+        await self.global_cog.start_timeout(
             wrapper,
             objects=self.scene.value,
             rule=self.text
@@ -194,12 +194,16 @@ class GlobalCog(commands.Cog, name="Baba Is You"):
         return not self.bot.loading
 
     async def start_timeout(self, ctx, *args, timeout_multiplier: float = 1.0, **kwargs):
-        def handler(_signum, _frame):
-            raise AssertionError("The command took too long and was timed out.")
+        timeout = constants.TIMEOUT_DURATION * timeout_multiplier
+        deadline = time.monotonic() + timeout
+
+        async def guarded():
+            # Parsing runs on the event loop, where only a signal can interrupt it
+            with interrupt_after(deadline):
+                await self.render_tiles(ctx, *args, deadline=deadline, **kwargs)
 
-        signal.signal(signal.SIGALRM, handler)
-        signal.alarm(int(constants.TIMEOUT_DURATION * timeout_multiplier))
-        await self.render_tiles(ctx, *args, **kwargs)
+        # Cancelling the task also flags any job running on the render pool
+        await asyncio.wait_for(guarded(), timeout)
 
     async def handle_variant_errors(self, ctx: Context, err: errors.VariantError):
         """Handle errors raised in a command context by variant handlers."""
@@ -275,8 +279,10 @@ class GlobalCog(commands.Cog, name="Baba Is You"):
             return await ctx.error(f"{msg}.")
 
     async def handle_grid(
-            self, ctx, grid, possible_variants, tile_borders=False):
-        """Parses a TileSkeleton array into a Tile grid."""
+            self, ctx, grid, possible_variants, tile_borders=False, deadline: float | None = None):
+        """Parses a TileSkeleton array into a Tile grid.
+
+        The tiles are prepared on the render pool, so the event loop stays responsive."""
         tile_data_cache = {
             data.name: data async for data in self.bot.db.tiles(
                 {
@@ -284,270 +290,280 @@ class GlobalCog(commands.Cog, name="Baba Is You"):
                 }
             )
         }
-        return [
-            [
-                [
-                    [
+        return await self.bot.renderer.pool.run(
+            self.prepare_grid_sync, ctx, grid, possible_variants, tile_data_cache, tile_borders, deadline=deadline)
+
+    def prepare_grid_sync(self, ctx, grid, possible_variants, tile_data_cache, tile_borders, *, job: RenderJob):
+        """Blocking implementation of `handle_grid`. Runs on a worker thread."""
+        return asyncio.run(self.prepare_grid(ctx, grid, possible_variants, tile_data_cache, tile_borders, job))
+
+    async def prepare_grid(self, ctx, grid, possible_variants, tile_data_cache, tile_borders, job: RenderJob):
+        full_grid = []
+        for w, timestep in enumerate(grid):
+            a = []
+            for z, layer in enumerate(timestep):
+                b = []
+                for y, row in enumerate(layer):
+                    c = []
+                    for x, tile in enumerate(row):
+                        # Lets timeouts cancel long parses
+                        job.check()
                         # grid gets passed by reference, as it is mutable
-                        await Tile.prepare(possible_variants, tile, tile_data_cache, grid, (w, z, y, x), tile_borders,
-                                           ctx)
-                        for x, tile in enumerate(row)
-                    ]
-                    for y, row in enumerate(layer)
-                ]
-                for z, layer in enumerate(timestep)
-            ]
-            for w, timestep in enumerate(grid)
-        ]
+                        c.append(await Tile.prepare(possible_variants, tile, tile_data_cache, grid, (w, z, y, x),
+                                                    tile_borders, ctx))
+                    b.append(c)
+                a.append(b)
+            full_grid.append(a)
+        return full_grid
+
+    async def render_grid(self, full_grid, render_ctx: RenderContext, deadline: float | None = None):
+        """Renders a parsed Tile grid, returning statistics about the render."""
+        full_tiles, unique_tiles, rendered_frames, render_overhead = await self.bot.renderer.render_full_tiles(
+            full_grid,
+            ctx=render_ctx,
+            deadline=deadline
+        )
+        composite_overhead, saving_overhead, im_size = await self.bot.renderer.render(
+            full_tiles,
+            render_ctx,
+            deadline=deadline
+        )
+        return unique_tiles, rendered_frames, render_overhead, composite_overhead, saving_overhead, im_size
 
-    async def render_tiles(self, ctx: Context, *, objects: str, rule: bool):
+    async def render_tiles(self, ctx: Context, *, objects: str, rule: bool, deadline: float | None = None):
         """Performs the bulk work for both `tile` and `rule` commands."""
-        try:
-            await ctx.typing()
-            ctx.silent = ctx.message is not None and ctx.message.flags.silent
-            tiles = emoji.demojize(objects.strip(), language='alias').replace(":hearts:",
-                                                                              "♥")  # keep the heart, for the people
-            tiles = re.sub(r'<a?(:.+?:)\d+?>', r'\1', tiles)
-            tiles = re.sub(r"\\(?=[:<])", "", tiles)
-            tiles = re.sub(r"(?<!\\)`", "", tiles)
-            # Replace some phrases
-            replace_list = [
-                ['а', 'a'],
-                ['в', 'b'],
-                ['е', 'e'],
-                ['з', '3'],
-                ['к', 'k'],
-                ['м', 'm'],
-                ['н', 'h'],
-                ['о', 'o'],
-                ['р', 'p'],
-                ['с', 'c'],
-                ['т', 't'],
-                ['х', 'x'],
-                ['ⓜ', ':m:'],
-                [':thumbsdown:', ':-1:']
-            ]
-            for src, dst in replace_list:
-                tiles = tiles.replace(src, dst)
+        await ctx.typing()
+        ctx.silent = ctx.message is not None and ctx.message.flags.silent
+        tiles = emoji.demojize(objects.strip(), language='alias').replace(":hearts:",
+                                                                          "♥")  # keep the heart, for the people
+        tiles = re.sub(r'<a?(:.+?:)\d+?>', r'\1', tiles)
+        tiles = re.sub(r"\\(?=[:<])", "", tiles)
+        tiles = re.sub(r"(?<!\\)`", "", tiles)
+        # Replace some phrases
+        replace_list = [
+            ['а', 'a'],
+            ['в', 'b'],
+            ['е', 'e'],
+            ['з', '3'],
+            ['к', 'k'],
+            ['м', 'm'],
+            ['н', 'h'],
+            ['о', 'o'],
+            ['р', 'p'],
+            ['с', 'c'],
+            ['т', 't'],
+            ['х', 'x'],
+            ['ⓜ', ':m:'],
+            [':thumbsdown:', ':-1:']
+        ]
+        for src, dst in replace_list:
+            tiles = tiles.replace(src, dst)
 
-            # Determines if this should be a spoiler
-            spoiler = "||" in tiles
-            tiles = tiles.replace("||", "")
+        # Determines if this should be a spoiler
+        spoiler = "||" in tiles
+        tiles = tiles.replace("||", "")
 
-            # Check flags
-            old_tiles = tiles
+        # Check flags
+        old_tiles = tiles
 
-            parsing_overhead = time.perf_counter()
+        parsing_overhead = time.perf_counter()
 
-            render_ctx = RenderContext(ctx=ctx)
-            while match := re.match(r"^\s*(--?((?:(?!=)\S)+)(?:=(?:(?!(?<!\\)\s).)+)?)", tiles):
-                potential_flag = match.group(1)
-                for flag in self.bot.flags.list:
-                    if await flag.match(potential_flag, render_ctx):
-                        tiles = tiles[match.end():]
-                        break
-                else:
-                    interp = match.group().strip().replace('`', "'")
-                    raise AssertionError(f"Flag `{interp}` isn't valid.")
-
-            offset = 0
-            for match in re.finditer(r"(?<!\\)\"(.*?)(?<!\\)\"", tiles, flags=re.RegexFlag.DOTALL):
-                a, b = match.span()
-                text = match.group(1)
-                prefix = "tile_" if rule else "text_"
-                sliced = re.split("([\n ]|$)", text)
-                zipped = zip(sliced[1::2], sliced[:-1:2])
-                text = "".join(f"{prefix}{t}{joiner}" if t != "-" else f"-{joiner}" for joiner, t in zipped)
-                tiles = tiles[:a - offset] + text + tiles[b - offset:]
-                offset += (b - a) - len(text)
-
-            user_macros = ctx.bot.macros | render_ctx.macros
-            last_tiles = None
-            passes = 0
-            while last_tiles != tiles and passes < 50:
-                last_tiles = tiles
-                tiles, _ = ctx.bot.macro_handler.parse_macros(tiles, False, user_macros, "r" if rule else "t")
-                tiles = tiles.strip()
-                passes += 1
-
-            # Check for empty input
-            if not tiles:
-                return await ctx.error("Input cannot have 0 tiles.")
-
-            # Split input into lines
-            word_rows = tiles.splitlines()
-
-            # Split each row into words
-            word_grid = [re.split(r"(?<!\\) ", row) for row in word_rows]
-
-            word_grid = split_commas(word_grid, "char_")
-            try:
-                if rule:
-                    comma_grid = split_commas(word_grid, "tile_")
-                else:
-                    comma_grid = split_commas(word_grid, "text_")
-                comma_grid = split_commas(comma_grid, "$")
-            except errors.SplittingException as e:
-                cause = e.args[0]
-                return await ctx.error(f"I couldn't split the following input into separate objects: \"{cause}\".")
-
-            tilecount = 0
-            maxstack = 1
-            maxdelta = 1
-            try:
-                for row in comma_grid:
-                    for stack in row:
-                        maxstack = max(maxstack, len(re.split(r'(?<!\\)&', stack)))
-                        for timeline in re.split(r'(?<!\\)&', stack):
-                            maxdelta = max(maxdelta, len(re.split(r'(?<!\\)>', timeline)))
-                w, h, d, t = max([len(comma_grid[n]) for n in range(len(comma_grid))]), len(
-                    comma_grid), maxstack, maxdelta  # width, height, depth, time
-                layer_grid = np.full((t, d, h, w), TileSkeleton(), dtype=object)
-                if maxstack > constants.MAX_STACK and ctx.author.id != self.bot.owner_id:
-                    return await ctx.error(
-                        f"Stack too high ({maxstack}).\nYou may only stack up to {constants.MAX_STACK} tiles on one space.")
-
-                possible_variants = RegexDict(
-                    [(variant.pattern, variant) for variant in ctx.bot.variants._values if variant.type != "sign"])
-                font_variants = RegexDict(
-                    [(variant.pattern, variant) for variant in ctx.bot.variants._values if variant.type == "sign"])
-
-                possible_variant_names = [name for variant in ctx.bot.variants._values for name in variant.name if
-                                          len(name)]
-
-                def catch(f, *args, **kwargs):
-                    try:
-                        return f(*args, **kwargs)
-                    except:
-                        return None
-
-                for y, row in enumerate(comma_grid):
-                    for x, stack in enumerate(row):
-                        for l, timeline in enumerate(re.split(r'(?<!\\)&', stack)):
-                            for d, tile in enumerate(timeline_split := re.split(r'(?<!\\)>', timeline)):
-                                if len(tile):
-                                    if (match := re.fullmatch(r"\{(.*)}(.*)", tile)) is not None:
-                                        sign_text = SignText(text=match.group(1), x=x, y=y, time_start=d)
-                                        variants = [variant for variant in match.group(2).split(":") if len(variant)]
-                                        variants = parse_variants(
-                                            self.bot,
-                                            font_variants, variants,
-                                            macros=user_macros
-                                        ).get("sign", [])
-                                        for variant in variants:
-                                            await variant.apply(sign_text, bot=self.bot, ctx=render_ctx)
-                                        layer_grid[d:, l, y, x] = TileSkeleton()
-                                        for o in range(1, maxdelta - d):
-                                            try:
-                                                text = timeline_split[d + o]
-                                                if len(text):
-                                                    break
-                                            except IndexError:
-                                                continue
-                                        else:
-                                            o = maxdelta - d
-                                        sign_text.time_end = d + o
-                                        # Sign texts sadly cannot respect layers.
-                                        render_ctx.sign_texts.append(sign_text)
-                                        continue
-                                    tile = re.sub(r"\\(.)", r"\1", tile)
-                                    assert not len(tile.split(':', 1)) - 1 or not tile.split(':', 1)[1].count(
-                                        ';'), 'Error! Persistent variants (`;`) can\'t come after ephemeral ones (`:`).'
-                                    if catch(tile.index, ":") or catch(tile.index, ";") \
-                                            or ":" not in tile and ";" not in tile:
-                                        tilecount += 1
-                                        # This is done to prevent setting everything to one instance of an object.
-                                        layer_grid[d:, l, y, x] = [
-                                            await TileSkeleton.parse(
-                                                self.bot, possible_variants, tile, rule,
-                                                palette=render_ctx.palette,
-                                                global_variant=render_ctx.global_variant,
-                                                possible_variant_names=possible_variant_names,
-                                                macros=user_macros
-                                            )
-                                            for _ in range(layer_grid.shape[0] - d)
-                                        ]
+        render_ctx = RenderContext(ctx=ctx)
+        while match := re.match(r"^\s*(--?((?:(?!=)\S)+)(?:=(?:(?!(?<!\\)\s).)+)?)", tiles):
+            potential_flag = match.group(1)
+            for flag in self.bot.flags.list:
+                if await flag.match(potential_flag, render_ctx):
+                    tiles = tiles[match.end():]
+                    break
+            else:
+                interp = match.group().strip().replace('`', "'")
+                raise AssertionError(f"Flag `{interp}` isn't valid.")
+
+        offset = 0
+        for match in re.finditer(r"(?<!\\)\"(.*?)(?<!\\)\"", tiles, flags=re.RegexFlag.DOTALL):
+            a, b = match.span()
+            text = match.group(1)
+            prefix = "tile_" if rule else "text_"
+            sliced = re.split("([\n ]|$)", text)
+            zipped = zip(sliced[1::2], sliced[:-1:2])
+            text = "".join(f"{prefix}{t}{joiner}" if t != "-" else f"-{joiner}" for joiner, t in zipped)
+            tiles = tiles[:a - offset] + text + tiles[b - offset:]
+            offset += (b - a) - len(text)
+
+        user_macros = ctx.bot.macros | render_ctx.macros
+        tiles, _ = ctx.bot.macro_handler.parse_macros(tiles, False, user_macros, "r" if rule else "t")
+        tiles = tiles.strip()
+
+        # Check for empty input
+        if not tiles:
+            return await ctx.error("Input cannot have 0 tiles.")
+
+        # Split input into lines
+        word_rows = tiles.splitlines()
+
+        # Split each row into words
+        word_grid = [re.split(r"(?<!\\) ", row) for row in word_rows]
+
+        word_grid = split_commas(word_grid, "char_")
+        try:
+            if rule:
+                comma_grid = split_commas(word_grid, "tile_")
+            else:
+                comma_grid = split_commas(word_grid, "text_")
+            comma_grid = split_commas(comma_grid, "$")
+        except errors.SplittingException as e:
+            cause = e.args[0]
+            return await ctx.error(f"I couldn't split the following input into separate objects: \"{cause}\".")
+
+        tilecount = 0
+        maxstack = 1
+        maxdelta = 1
+        try:
+            for row in comma_grid:
+                for stack in row:
+                    maxstack = max(maxstack, len(re.split(r'(?<!\\)&', stack)))
+                    for timeline in re.split(r'(?<!\\)&', stack):
+                        maxdelta = max(maxdelta, len(re.split(r'(?<!\\)>', timeline)))
+            w, h, d, t = max([len(comma_grid[n]) for n in range(len(comma_grid))]), len(
+                comma_grid), maxstack, maxdelta  # width, height, depth, time
+            layer_grid = np.full((t, d, h, w), TileSkeleton(), dtype=object)
+            if maxstack > constants.MAX_STACK and ctx.author.id != self.bot.owner_id:
+                return await ctx.error(
+                    f"Stack too high ({maxstack}).\nYou may only stack up to {constants.MAX_STACK} tiles on one space.")
+
+            possible_variants = ctx.bot.tile_variants
+            font_variants = ctx.bot.sign_variants
+            possible_variant_names = ctx.bot.variant_names
+
+            def catch(f, *args, **kwargs):
+                try:
+                    return f(*args, **kwargs)
+                except:
+                    return None
+
+            for y, row in enumerate(comma_grid):
+                for x, stack in enumerate(row):
+                    for l, timeline in enumerate(re.split(r'(?<!\\)&', stack)):
+                        for d, tile in enumerate(timeline_split := re.split(r'(?<!\\)>', timeline)):
+                            if len(tile):
+                                if (match := re.fullmatch(r"\{(.*)}(.*)", tile)) is not None:
+                                    sign_text = SignText(text=match.group(1), x=x, y=y, time_start=d)
+                                    variants = [variant for variant in match.group(2).split(":") if len(variant)]
+                                    variants = parse_variants(
+                                        self.bot,
+                                        font_variants, variants,
+                                        macros=user_macros
+                                    ).get("sign", [])
+                                    for variant in variants:
+                                        await variant.apply(sign_text, bot=self.bot, ctx=render_ctx)
+                                    layer_grid[d:, l, y, x] = TileSkeleton()
+                                    for o in range(1, maxdelta - d):
+                                        try:
+                                            text = timeline_split[d + o]
+                                            if len(text):
+                                                break
+                                        except IndexError:
+                                            continue
                                     else:
-                                        layer_grid[d:, l, y, x] = [
-                                            await TileSkeleton.parse(
-                                                self.bot,
-                                                possible_variants,
-                                                layer_grid[d - 1, l, y, x].raw_string.split(
-                                                    ";" if ";" in tile else ":", 1
-                                                )[0] + tile,
-                                                rule,
-                                                possible_variant_names=possible_variant_names,
-                                                macros=user_macros,
-                                                palette=render_ctx.palette
-                                            )
-                                            for _ in range(layer_grid.shape[0] - d)
-                                        ]
-                # Get the dimensions of the grid
-                grid_shape = layer_grid.shape
-                # Don't proceed if the request is too large.
-                # (It shouldn't be that long to begin with because of Discord's 2000-character limit)
-                if tilecount > constants.MAX_TILES and not (
-                        ctx.author.id in [self.bot.owner_id, 280756504674566144]):
-                    return await ctx.error(
-                        f"Too many tiles ({tilecount}). You may only render up to {constants.MAX_TILES} tiles at once, including empty tiles.")
-                # Handles variants based on `:` affixes
-                render_ctx.out = BytesIO()
-                render_ctx.extra_out = BytesIO() if render_ctx.raw_output else None
-                full_grid = await self.handle_grid(ctx, layer_grid, possible_variants, render_ctx.tileborder)
-                parsing_overhead = time.perf_counter() - parsing_overhead
-                full_tiles, unique_tiles, rendered_frames, render_overhead = await self.bot.renderer.render_full_tiles(
-                    full_grid,
-                    ctx=render_ctx
-                )
-                composite_overhead, saving_overhead, im_size = await self.bot.renderer.render(
-                    full_tiles,
-                    render_ctx
-                )
-            except errors.TileNotFound as e:
-                word = e.args[0]
-                if word.startswith("tile_") and await self.bot.db.tile(word[5:]) is not None:
-                    return await ctx.error(f"The tile `{word}` could not be found. Perhaps you meant `{word[5:]}`?")
-                if await self.bot.db.tile("text_" + word) is not None:
-                    return await ctx.error(
-                        f"The tile `{word}` could not be found. Perhaps you meant `{'text_' + word}`?")
-                return await ctx.error(f"The tile `{word}` could not be found.")
-            except errors.BadTileProperty as e:
-                traceback.print_exc()
-                return await ctx.error(f"Error! `{e.args[1]}`")
-            except errors.EmptyVariant as e:
-                word = e.args[0]
+                                        o = maxdelta - d
+                                    sign_text.time_end = d + o
+                                    # Sign texts sadly cannot respect layers.
+                                    render_ctx.sign_texts.append(sign_text)
+                                    continue
+                                tile = re.sub(r"\\(.)", r"\1", tile)
+                                assert not len(tile.split(':', 1)) - 1 or not tile.split(':', 1)[1].count(
+                                    ';'), 'Error! Persistent variants (`;`) can\'t come after ephemeral ones (`:`).'
+                                if catch(tile.index, ":") or catch(tile.index, ";") \
+                                        or ":" not in tile and ";" not in tile:
+                                    tilecount += 1
+                                    # Parsed once and shared by every later timestep, since tiles never modify it
+                                    layer_grid[d:, l, y, x] = await TileSkeleton.parse(
+                                        self.bot, possible_variants, tile, rule,
+                                        palette=render_ctx.palette,
+                                        global_variant=render_ctx.global_variant,
+                                        possible_variant_names=possible_variant_names,
+                                        macros=user_macros
+                                    )
+                                else:
+                                    layer_grid[d:, l, y, x] = await TileSkeleton.parse(
+                                        self.bot,
+                                        possible_variants,
+                                        layer_grid[d - 1, l, y, x].raw_string.split(
+                                            ";" if ";" in tile else ":", 1
+                                        )[0] + tile,
+                                        rule,
+                                        possible_variant_names=possible_variant_names,
+                                        macros=user_macros,
+                                        palette=render_ctx.palette
+                                    )
+            # Get the dimensions of the grid
+            grid_shape = layer_grid.shape
+            # Don't proceed if the request is too large.
+            # (It shouldn't be that long to begin with because of Discord's 2000-character limit)
+            if tilecount > constants.MAX_TILES and not (
+                    ctx.author.id in [self.bot.owner_id, 280756504674566144]):
                 return await ctx.error(
-                    f"You provided an empty variant for `{word}`."
-                )
-            except errors.TooLargeTile as e:
+                    f"Too many tiles ({tilecount}). You may only render up to {constants.MAX_TILES} tiles at once, including empty tiles.")
+            # Handles variants based on `:` affixes
+            render_ctx.out = BytesIO()
+            render_ctx.extra_out = BytesIO() if render_ctx.raw_output else None
+            full_grid = await self.handle_grid(ctx, layer_grid, possible_variants, render_ctx.tileborder, deadline)
+            parsing_overhead = time.perf_counter() - parsing_overhead
+            cache_key = self.bot.renderer.render_cache.key(full_grid, render_ctx)
+            stats = await self.bot.renderer.render_cache.fetch(
+                cache_key, render_ctx, functools.partial(self.render_grid, full_grid, render_ctx, deadline))
+            if stats is None:
+                # Served from the cache
+                with Image.open(render_ctx.out) as im:
+                    im_size = im.size
+                render_ctx.out.seek(0)
+                stats = 0, 0, 0.0, 0.0, 0.0, im_size
+            unique_tiles, rendered_frames, render_overhead, composite_overhead, saving_overhead, im_size = stats
+        except errors.TileNotFound as e:
+            word = e.args[0]
+            if word.startswith("tile_") and await self.bot.db.tile(word[5:]) is not None:
+                return await ctx.error(f"The tile `{word}` could not be found. Perhaps you meant `{word[5:]}`?")
+            if await self.bot.db.tile("text_" + word) is not None:
                 return await ctx.error(
-                    f"A tile of size `{e.args[0]}` is larger than the maximum allowed size of `{constants.MAX_TILE_SIZE}`.")
-            except errors.VariantError as e:
-                return await self.handle_variant_errors(ctx, e)
-            except errors.TextGenerationError as e:
-                return await self.handle_custom_text_errors(ctx, e)
-
-            filename = datetime.utcnow().strftime(
-                f"render_%Y-%m-%d_%H.%M.%S.{render_ctx.image_format}")
-            image = discord.File(render_ctx.out, filename=filename, spoiler=spoiler)
-            if hasattr(ctx, "fake"):
-                prefix = ""
-            else:
-                prefix = ctx.message.content.split(' ', 1)[0] + " "
-            description = f"{'||' if spoiler else ''}```\n{prefix}{old_tiles}\n```{'||' if spoiler else ''}"
-            if render_ctx.do_embed:
-                embed = discord.Embed(color=self.bot.embed_color)
-
-                def rendertime(v):
-                    v *= 1000
-                    nice = False
-                    if math.ceil(v) == 69:
-                        nice = True
-                    if objects == "lag":
-                        v *= 100000
-                    return f'{v:.4f}' + ("(nice)" if nice else "")
-
-                stats = f'''
+                    f"The tile `{word}` could not be found. Perhaps you meant `{'text_' + word}`?")
+            return await ctx.error(f"The tile `{word}` could not be found.")
+        except errors.BadTileProperty as e:
+            traceback.print_exc()
+            return await ctx.error(f"Error! `{e.args[1]}`")
+        except errors.EmptyVariant as e:
+            word = e.args[0]
+            return await ctx.error(
+                f"You provided an empty variant for `{word}`."
+            )
+        except errors.TooLargeTile as e:
+            return await ctx.error(
+                f"A tile of size `{e.args[0]}` is larger than the maximum allowed size of `{constants.MAX_TILE_SIZE}`.")
+        except errors.VariantError as e:
+            return await self.handle_variant_errors(ctx, e)
+        except errors.TextGenerationError as e:
+            return await self.handle_custom_text_errors(ctx, e)
+
+        filename = datetime.utcnow().strftime(
+            f"render_%Y-%m-%d_%H.%M.%S.{render_ctx.image_format}")
+        image = discord.File(render_ctx.out, filename=filename, spoiler=spoiler)
+        if hasattr(ctx, "fake"):
+            prefix = ""
+        else:
+            prefix = ctx.message.content.split(' ', 1)[0] + " "
+        description = f"{'||' if spoiler else ''}```\n{prefix}{old_tiles}\n```{'||' if spoiler else ''}"
+        if render_ctx.do_embed:
+            embed = discord.Embed(color=self.bot.embed_color)
+
+            def rendertime(v):
+                v *= 1000
+                nice = False
+                if math.ceil(v) == 69:
+                    nice = True
+                if objects == "lag":
+                    v *= 100000
+                return f'{v:.4f}' + ("(nice)" if nice else "")
+
+            stats = f'''
 - Response time: {rendertime(parsing_overhead + render_overhead + composite_overhead + saving_overhead)} ms
   - Parsing overhead: {rendertime(parsing_overhead)} ms
   - Rendering overhead: {rendertime(render_overhead)} ms
@@ -559,17 +575,15 @@ class GlobalCog(commands.Cog, name="Baba Is You"):
 - Image size: {im_size}
     '''
 
-                embed.add_field(name="Render statistics", value=stats)
-            else:
-                embed = None
-            if render_ctx.extra_out is not None:
-                render_ctx.extra_out.seek(0)
-                await ctx.reply(description[:2000], embed=embed,
-                                files=[discord.File(render_ctx.extra_out, filename=f"raw.zip"), image])
-            else:
-                await ctx.reply(description[:2000], embed=embed, file=image)
-        finally:
-            signal.alarm(0)
+            embed.add_field(name="Render statistics", value=stats)
+        else:
+            embed = None
+        if render_ctx.extra_out is not None:
+            render_ctx.extra_out.seek(0)
+            await ctx.reply(description[:2000], embed=embed,
+                            files=[discord.File(render_ctx.extra_out, filename=f"raw.zip"), image])
+        else:
+            await ctx.reply(description[:2000], embed=embed, file=image)
 
     @app_commands.command()
     @app_commands.allowed_installs(guilds=False, users=True)
@@ -1016,9 +1030,13 @@ Filterimages are formatted as follows:
             filter_url = ctx.message.attachments[0].url
         except IndexError:
             return await ctx.error("The filter to be converted wasn't attached.")
-        filter_headers = requests.head(filter_url, timeout=3).headers
-        assert int(filter_headers.get("content-length", 0)) < constants.FILTER_MAX_SIZE, f"Filter is too big!"
-        with Image.open(requests.get(filter_url, stream=True).raw) as im:
+        filter_name = ctx.message.attachments[0].filename
+        try:
+            async with self.bot.db.session.get(filter_url) as resp:
+                buffer = await self.bot.db.read_filter(resp, filter_name)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise AssertionError(f"Filter `{filter_name}` couldn't be downloaded!")
+        with Image.open(BytesIO(buffer)) as im:
             assert im.width <= 256 and im.height <= 256, "Can't create a filter greater than 256 pixels on either side!"
             fil = np.array(im.convert("RGBA"), dtype=np.uint8)
         fil[..., :2] += np.indices(fil.shape[1::-1]).astype(np.uint8).T * np.uint8(
@@ -1083,6 +1101,7 @@ Filterimages are formatted as follows:
             command = "INSERT INTO filterimages VALUES (?, ?, ?, ?);"
             args = (name, target_mode.startswith("abs"), url, ctx.author.id)
             await cursor.execute(command, args)
+            await self.bot.db.forget_filter(name)
             emb = discord.Embed(
                 color=ctx.bot.embed_color,
                 title="Registered!",
@@ -1128,8 +1147,7 @@ Filterimages are formatted as follows:
             assert url is not None, f"The filter `{name}` doesn't exist, or you don't have permission to remove it!"
             url = url[0]
             await cursor.execute(f"DELETE FROM filterimages WHERE url == ?;", url)
-            if name in self.bot.db.filter_cache:
-                del self.bot.db.filter_cache[name]
+            await self.bot.db.forget_filter(name)
             emb = discord.Embed(
                 color=ctx.bot.embed_color,
                 title="Deleted!",
@@ -6,12 +6,10 @@ import numpy as np
 from PIL import Image, ImageDraw
 
 
-def sorter(x):
-    # print(x.shape)
-    # lambda y: 0 if (y[3] == 0) else 1)
-    out = np.array(sorted(x, key=lambda y: int(y[3] != 0)))
-    # print(out.shape)
-    return out
+def sorter(x, axis=0):
+    # Stable, so that transparent and opaque pixels both stay in order
+    order = np.argsort(x[..., 3] != 0, axis=axis, kind="stable")
+    return np.take_along_axis(x, np.expand_dims(order, -1), axis=axis)
 
 
 def flatten_to_color_array(x):
@@ -30,6 +28,15 @@ def get_colors_unsorted(x):
     return np.array([arr[index] for index in sorted(indexes)])
 
 
+def count_most_used_color(x):
+    f = flatten_to_color_array(x)
+    colors, counts = np.unique(f[f[:, 3] != 0], axis=0, return_counts=True)
+    if not len(colors):
+        return [0, 0, 0, 0], 0
+    # Ties go to the first color in sorted order
+    return colors[np.argmax(counts)], counts.max()
+
+
 def count_instances_of_color(x, color):
     f = flatten_to_color_array(x)
     return np.count_nonzero((f[:] == color).all(1))
@@ -67,44 +74,25 @@ def makecircle(size, radius, color):
 
 def liquify(img):
     # Count colors
-    most_used_color = [0, 0, 0, 0]
-    most_used_color_count = 0
-    total_color_count = 0
-    for color in get_colors(img):
-        instances = count_instances_of_color(img, color)
-        if instances > most_used_color_count:
-            most_used_color_count = instances
-            most_used_color = color
-        total_color_count += instances
+    color, count = count_most_used_color(img)
 
     # Remove most used color
-    img = remove_instances_of_color(img, most_used_color)
+    img = remove_instances_of_color(img, color)
 
     # Collapse
-    img = img.swapaxes(0, 1)
-    for i in range(len(img)):
-        img[i] = sorter(img[i])
-    img = img.swapaxes(0, 1)
+    img = sorter(img)
 
     # Flood - where the magic happens
-    img = colorflood(img, most_used_color, most_used_color_count)
+    img = colorflood(img, color, count)
 
     return img
 
 
 def planet(img):
     # Count colors
-    most_used_color = [0, 0, 0, 0]
-    most_used_color_count = 0
-    total_color_count = 0
     colors = get_colors(img)
     if len(colors) > 1:
-        for color in colors:
-            instances = count_instances_of_color(img, color)
-            if instances > most_used_color_count:
-                most_used_color_count = instances
-                most_used_color = color
-            total_color_count += instances
+        most_used_color, most_used_color_count = count_most_used_color(img)
 
         # Remove most used color
         img = remove_instances_of_color(img, most_used_color)
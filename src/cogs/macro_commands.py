@@ -1,5 +1,5 @@
 import io
-import signal
+import time
 from datetime import datetime
 from typing import Literal
 
@@ -10,6 +10,7 @@ from discord.ext import commands, menus
 from .. import constants
 from ..types import Bot, Context, Macro, BuiltinMacro
 from ..utils import ButtonPages
+from ..workers import interrupt_after
 
 import re
 
@@ -23,12 +24,8 @@ async def coro_part(func, *args, **kwargs):
 
 
 async def start_timeout(fn, *args, **kwargs):
-    def handler(_signum, _frame):
-        raise AssertionError("The command took too long and was timed out.")
-
-    signal.signal(signal.SIGALRM, handler)
-    signal.alarm(int(constants.TIMEOUT_DURATION))
-    return fn(*args, **kwargs)
+    with interrupt_after(time.monotonic() + constants.TIMEOUT_DURATION):
+        return fn(*args, **kwargs)
 
 
 class MacroQuerySource(menus.ListPageSource):
@@ -157,6 +154,8 @@ class MacroCommandCog(commands.Cog, name='Macros'):
             self.bot.macros[new] = mac
         else:
             setattr(self.bot.macros[name], attribute, new)
+            if attribute == "value":
+                self.bot.macros[name].compile()
         return await ctx.reply(f"Edited `{name}`'s {attribute} to be `{new}`.")
 
     @macro.command(aliases=["rm", "remove", "del"])
@@ -206,44 +205,41 @@ class MacroCommandCog(commands.Cog, name='Macros'):
     @macro.command(aliases=["x", "run"])
     async def execute(self, ctx: Context, *, macro: str):
         """Executes some given macroscript and outputs its return value."""
-        try:
-            macros = ctx.bot.macros | {}
-            debug_info = False
-            if match := re.match(r"^\s*--?d(?:ebug|bg)?", macro):
-                debug_info = True
-                macro = macro[match.end():]
-            while match := re.match(r"^\s*--?mc=((?:(?!(?<!\\)\|).)*)\|((?:(?!(?<!\\)\s).)*)", macro):
-                macros[match.group(1)] = Macro(value=match.group(2), description="<internal>", author=-1)
-                macro = macro[match.end():]
-
-            def parse():
-                nonlocal debug_info
-                return ctx.bot.macro_handler.parse_macros(macro.strip(), debug_info)
-
-            macro, debug = await start_timeout(parse)
-
-            message, files = "", []
-
-            if macro is not None:
-                if len(macro) > 1900:
-                    out = io.BytesIO()
-                    out.write(bytes(macro, 'utf-8'))
-                    out.seek(0)
-                    files.append(discord.File(out, filename=f'output-{datetime.now().isoformat()}.txt'))
-                    message = 'Output:'
-                else:
-                    message = f'Output: ```\n{macro.replace("```", "``ˋ")}\n```'
-            else:
-                message = "Error occurred while parsing macro. See debug info for details."
-            if debug is not None:
-                debug_file = "\n".join(debug)
+        macros = ctx.bot.macros | {}
+        debug_info = False
+        if match := re.match(r"^\s*--?d(?:ebug|bg)?", macro):
+            debug_info = True
+            macro = macro[match.end():]
+        while match := re.match(r"^\s*--?mc=((?:(?!(?<!\\)\|).)*)\|((?:(?!(?<!\\)\s).)*)", macro):
+            macros[match.group(1)] = Macro(value=match.group(2), description="<internal>", author=-1)
+            macro = macro[match.end():]
+
+        def parse():
+            nonlocal debug_info
+            return ctx.bot.macro_handler.parse_macros(macro.strip(), debug_info)
+
+        macro, debug = await start_timeout(parse)
+
+        message, files = "", []
+
+        if macro is not None:
+            if len(macro) > 1900:
                 out = io.BytesIO()
-                out.write(bytes(debug_file, 'utf-8'))
+                out.write(bytes(macro, 'utf-8'))
                 out.seek(0)
-                files.append(discord.File(out, filename=f'debug-{datetime.now().isoformat()}.txt'))
-            return await ctx.reply(message, files=files)
-        finally:
-            signal.alarm(0)
+                files.append(discord.File(out, filename=f'output-{datetime.now().isoformat()}.txt'))
+                message = 'Output:'
+            else:
+                message = f'Output: ```\n{macro.replace("```", "``ˋ")}\n```'
+        else:
+            message = "Error occurred while parsing macro. See debug info for details."
+        if debug is not None:
+            debug_file = "\n".join(debug)
+            out = io.BytesIO()
+            out.write(bytes(debug_file, 'utf-8'))
+            out.seek(0)
+            files.append(discord.File(out, filename=f'debug-{datetime.now().isoformat()}.txt'))
+        return await ctx.reply(message, files=files)
 
     @macro.command(aliases=["i", "get"])
     async def info(self, ctx: Context, name: str):
@@ -1,5 +1,6 @@
 import math
 import re
+from collections import deque
 from random import random, seed
 from cmath import log
 from functools import reduce
@@ -12,11 +13,105 @@ import zlib
 from .. import constants, errors
 from ..types import Bot, BuiltinMacro
 
+SPECIAL_PATTERN = re.compile(r"[\[\]\\]")
+
+# The contents of a macro are plain characters and escaped brackets, optionally starting with an escaped bracket,
+# the same as the pattern (?:\\[\[\]])?(?:[^\[\]]|[^\\]\\[\[\]])*? matches. Note that the character before an
+# escaped bracket can be an unescaped one. These are the states of a bracket's contents as they're read.
+BOUNDARY = 1  # Between two parts, where the macro can end
+AFTER_X = 2  # After the character before an escaped bracket
+AFTER_X_SLASH = 4  # After that and a backslash
+AFTER_LEAD_SLASH = 8  # After a backslash that the contents start with
+START = 16  # Before anything
+
+
+def advance_contents(state: int, char: str) -> int:
+    """Reads the next character of a macro's contents."""
+    new_state = 0
+    if state & BOUNDARY:
+        if char not in "[]":
+            new_state |= BOUNDARY
+        if char != "\\":
+            new_state |= AFTER_X
+    if state & AFTER_X and char == "\\":
+        new_state |= AFTER_X_SLASH
+    if state & (AFTER_X_SLASH | AFTER_LEAD_SLASH) and char in "[]":
+        new_state |= BOUNDARY
+    if state & START and char == "\\":
+        new_state |= AFTER_LEAD_SLASH
+    return new_state
+
+
+class MacroTrace:
+    """A record of the steps taken while evaluating macros, for debugging.
+
+    Each step is stored as what was replaced, what replaced it, and a little of the text around it,
+    rather than the whole string. Only the last `limit` entries are kept.
+    """
+    CONTEXT = 32
+
+    def __init__(self, limit: int = constants.MACRO_TRACE_LIMIT):
+        self.entries: deque[tuple[str, ...]] = deque(maxlen=limit)
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, message: str):
+        self.entries.append((message,))
+        self.total += 1
+
+    def step(self, label: str, before: str, old: str, new: str, after: str):
+        """Records `old` being replaced with `new`, between the end of `before` and the start of `after`."""
+        context = self.CONTEXT
+        self.entries.append((
+            label,
+            ("…" if len(before) > context else "") + before[-context:],
+            old if len(old) <= context * 4 else f"{old[:context * 4]}…",
+            new if len(new) <= context * 4 else f"{new[:context * 4]}…",
+            after[:context] + ("…" if len(after) > context else "")
+        ))
+        self.total += 1
+
+    def render(self) -> list[str]:
+        lines = [f"[Trace] {self.total - len(self)} earlier entries were dropped."] if self.total > len(self) else []
+        for entry in self.entries:
+            if len(entry) == 1:
+                lines.append(entry[0])
+            else:
+                label, before, old, new, after = entry
+                lines.append(f"{label} {before}{{{old} => {new}}}{after}")
+        return lines
+
+
+def last_characters(pieces: list[str], count: int) -> str:
+    """Gets at least the last `count` characters of some joined pieces of text, if there are that many."""
+    tail = []
+    length = 0
+    for piece in reversed(pieces):
+        tail.append(piece)
+        length += len(piece)
+        if length > count:
+            break
+    return "".join(reversed(tail))
+
+
+def next_characters(pending: list[list], count: int) -> str:
+    """Gets up to the next `count` characters that are still to be read."""
+    head = []
+    length = 0
+    for text, position in reversed(pending):
+        head.append(text[position:position + count - length])
+        length += len(head[-1])
+        if length >= count:
+            break
+    return "".join(head)
+
 
 class MacroCog:
 
     def __init__(self, bot: Bot):
-        self.debug = []
+        self.debug = MacroTrace()
         self.bot = bot
         self.variables = {}
         self.builtins: dict[str, BuiltinMacro] = {}
@@ -496,39 +591,73 @@ class MacroCog:
 
     def parse_macros(self, objects: str, debug_info: bool, macros=None, cmd="x", init=True) -> tuple[Optional[str], Optional[list[str]]]:
         if init:
-            self.debug = []
+            self.debug = MacroTrace()
             self.variables = {}
             self.found = 0
         if macros is None:
             macros = self.bot.macros
 
-        # Find each outmost pair of brackets
-
-        while match := re.search(r"(?<!(?<!\\)\\)\[((?:\\[\[\]])?(?:[^\[\]]|(?:[^\\]\\[\[\]]))*?(?<!(?<!\\)\\))]", objects, re.RegexFlag.M): # there's probably a much better way to do this regex but i haven't found it
-            self.found += 1
-            if debug_info:
-                if self.found > constants.MACRO_LIMIT:
-                    self.debug.append(f"[Error] Reached step limit of {constants.MACRO_LIMIT}.")
-                    return None, self.debug
-            else:
-                assert self.found <= constants.MACRO_LIMIT, f"Too many macros in one render! The limit is {constants.MACRO_LIMIT}, while you reached {self.found}."
-            terminal = match.group(1)
-            if debug_info:
-                self.debug.append(f"[Step {self.found}] {objects}")
-            try:
-                objects = (
-                        objects[:match.start()] +
-                        self.parse_term_macro(terminal, macros, self.found, cmd, debug_info) +
-                        objects[match.end():]
-                )
-            except errors.FailedBuiltinMacro as err:
-                if debug_info:
-                    self.debug.append(f"[Error] Error in \"{err.raw}\": {err.message}")
-                    return None, self.debug
-                raise err
+        # Macros are evaluated innermost first, from left to right, and what they return is read
+        # before anything after it, the same as searching the whole string again after every step would.
+        # Read text goes into `out`, and segments that are still to be read are stacked in `pending`.
+        out: list[str] = []
+        pending: list[list] = [[objects, 0]]
+        # Opening brackets whose contents can still be matched, leftmost first, as
+        # (index in `out`, state of their contents, the list as it was before them)
+        candidates: list[tuple[int, int, list]] = []
+        while pending:
+            segment = pending[-1]
+            text, start = segment
+            match = SPECIAL_PATTERN.search(text, start)
+            end = len(text) if match is None else match.start()
+            if end > start:
+                out.append(text[start:end])
+                candidates = [(index, BOUNDARY | AFTER_X, before)
+                              for index, state, before in candidates if state & BOUNDARY]
+            if match is None:
+                pending.pop()
+                continue
+            segment[1] = end + 1
+            char = match.group()
+            # A bracket is escaped by a backslash, unless that backslash is escaped too
+            behind = "".join(out[-2:])[-2:]
+            escaped = behind[-1:] == "\\" and behind[:-1] != "\\"
+            if char == "]" and not escaped:
+                closing = next((candidate for candidate in candidates if candidate[1] & BOUNDARY), None)
+                if closing is not None:
+                    opening, _, candidates = closing
+                    terminal = "".join(out[opening + 1:])
+                    del out[opening:]
+                    self.found += 1
+                    step = self.found
+                    if debug_info:
+                        if self.found > constants.MACRO_LIMIT:
+                            self.debug.append(f"[Error] Reached step limit of {constants.MACRO_LIMIT}.")
+                            return None, self.debug.render()
+                    else:
+                        assert self.found <= constants.MACRO_LIMIT, f"Too many macros in one render! The limit is {constants.MACRO_LIMIT}, while you reached {self.found}."
+                    try:
+                        result = self.parse_term_macro(terminal, macros, self.found, cmd, debug_info)
+                    except errors.FailedBuiltinMacro as err:
+                        if debug_info:
+                            self.debug.append(f"[Error] Error in \"{err.raw}\": {err.message}")
+                            return None, self.debug.render()
+                        raise err
+                    if debug_info:
+                        self.debug.step(f"[Step {step}]", last_characters(out, MacroTrace.CONTEXT), f"[{terminal}]",
+                                        result, next_characters(pending, MacroTrace.CONTEXT + 1))
+                    pending.append([result, 0])
+                    continue
+            before = candidates
+            candidates = [(index, new_state, previous) for index, state, previous in candidates
+                          if (new_state := advance_contents(state, char))]
+            if char == "[" and not escaped:
+                candidates.append((len(out), BOUNDARY | START, before))
+            out.append(char)
+        objects = "".join(out)
         if debug_info:
             self.debug.append(f"[Out] {objects}")
-        return objects, self.debug if len(self.debug) else None
+        return objects, self.debug.render() if len(self.debug) else None
 
     def parse_term_macro(self, raw_variant, macros, step = 0, cmd = "x", debug_info = False) -> str:
         raw_macro, *macro_args = re.split(r"(?<!(?<!\\)\\)/", raw_variant)
@@ -539,12 +668,31 @@ class MacroCog:
             except Exception as err:
                 raise errors.FailedBuiltinMacro(raw_variant, err, isinstance(err, errors.CustomMacroError))
         elif raw_macro in macros:
-            macro = macros[raw_macro].value
-            macro = macro.replace("$#", str(len(macro_args)))
-            macro = macro.replace("$!", cmd)
+            template = macros[raw_macro].template
             macro_args = ["/".join(macro_args), *macro_args]
             arg_amount = 0
             iters = None
+            if template is not None and not debug_info and template[2] <= constants.MACRO_ARG_LIMIT:
+                # Fill in the arguments in one go, and only search the result if they could've made more
+                literals, slots, arg_amount = template
+                parts = [literals[0]]
+                for slot, literal in zip(slots, literals[1:]):
+                    if slot == "#":
+                        parts.append(str(len(macro_args) - 1))
+                    elif slot == "!":
+                        parts.append(cmd)
+                    else:
+                        try:
+                            parts.append(macro_args[slot])
+                        except IndexError:
+                            parts.append("\0" + str(slot))
+                    parts.append(literal)
+                macro = "".join(parts)
+                iters = 1 if "$" in macro else 0
+            else:
+                macro = macros[raw_macro].value
+                macro = macro.replace("$#", str(len(macro_args) - 1))
+                macro = macro.replace("$!", cmd)
             while iters != 0 and arg_amount <= constants.MACRO_ARG_LIMIT:
                 iters = 0
                 matches = [*re.finditer(r"\$(-?\d+|#|!)", macro)]
@@ -566,7 +714,9 @@ class MacroCog:
                         except IndexError:
                             infix = "\0" + str(argument)
                     if debug_info:
-                        self.debug.append(f"[Step {step}:{arg_amount}] {macro}")
+                        context = MacroTrace.CONTEXT + 1
+                        self.debug.step(f"[Step {step}:{arg_amount}]", macro[max(match.start() - context, 0):match.start()],
+                                        match.group(), infix, macro[match.end():match.end() + context])
                     macro = macro[:match.start()] + infix + macro[match.end():]
         else:
             raise AssertionError(f"Macro `{raw_macro}` of `{raw_variant}` not found in the database!")
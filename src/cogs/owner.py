@@ -31,6 +31,7 @@ from discord.ext import commands
 from PIL import Image, ImageChops, ImageDraw
 
 from ..db import TileData
+from ..sprites import build_pack
 from ..types import Bot, Context
 
 
@@ -490,6 +491,7 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             await cur.execute(
                 "DELETE FROM tiles WHERE source == 'baba' OR source == 'new_adv' OR source == 'museum'"
             )
+        await self.bot.db.load_tile_index()
 
         async def exists(tile: str):
             nonlocal ctx, cached_exists
@@ -618,8 +620,7 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
         if flag:
             # Flush the tile database since it all gets reconstructed anyway
             await self.bot.db.conn.execute('DELETE FROM tiles')
-        del self.bot.db.filter_cache  # Just to make absolutely sure that it gets flushed
-        self.bot.db.filter_cache = {}
+        self.bot.db.filter_cache.invalidate()
         await self.load_initial_tiles()
         await self.load_editor_tiles()
         await self.load_custom_tiles()
@@ -738,6 +739,7 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             ''',
             initial_objects.values()
         )
+        await self.bot.db.load_tile_index()
 
     async def load_editor_tiles(self):
         """Loads tile data from `data/editor_objectlist.lua`."""
@@ -831,9 +833,15 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             ''',
             objects
         )
+        await self.bot.db.load_tile_index()
 
     async def load_custom_tiles(self, file='*'):
         """Loads custom tile data from `data/custom/*.toml`"""
+        # The sprites of the reloaded sources may have changed on disk
+        await asyncio.to_thread(self.bot.renderer.sprite_cache.invalidate,
+                                "data/sprites/" if file == '*' else f"data/sprites/{file}/")
+        await asyncio.to_thread(self.bot.renderer.tile_cache.invalidate)
+        await self.bot.renderer.render_cache.clear()
 
         def prepare(source: str, name: str, d: dict[str, Any]) -> dict[str, Any]:
             """From config format to db format."""
@@ -941,6 +949,7 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
                     ''',
                     hacks
                 )
+        await self.bot.db.load_tile_index()
 
     @commands.command()
     @commands.is_owner()
@@ -974,6 +983,9 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             filemode = True
         async with self.bot.db.conn.cursor() as cur:
             result = await cur.execute(query)
+            if "tiles" in query.lower():
+                # The query might have changed tile data
+                await self.bot.db.load_tile_index()
             try:
                 data_rows = await result.fetchall()
                 data_column_headers = np.array(
@@ -1011,6 +1023,38 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             return await ctx.send('Output:', file=discord.File(out, filename='sql-output.txt'))
         return await ctx.send(f"Output:\n```\n{formatted}\n```")
 
+    @commands.command()
+    @commands.is_owner()
+    async def spritecache(self, ctx: Context, clear: bool = False):
+        """Shows statistics for the shared caches, optionally clearing them."""
+        sprite_cache, tile_cache = self.bot.renderer.sprite_cache, self.bot.renderer.tile_cache
+        render_cache = self.bot.renderer.render_cache
+        glyphs = self.bot.renderer.glyphs
+        stats = f"Sprites: {sprite_cache.stats()}\n\nTiles: {tile_cache.stats()}\n\nRenders: {render_cache.stats()}"
+        stats += f"\n\nFilters: {self.bot.db.filter_cache.stats()}\n\nAttachments: {self.bot.attachment_cache.stats()}"
+        if glyphs is not None:
+            stats += f"\n\nText: {glyphs.sprites.stats()}\nLayouts: {glyphs.layout.cache_info()}"
+        if clear:
+            await asyncio.to_thread(sprite_cache.invalidate)
+            await asyncio.to_thread(tile_cache.invalidate)
+            await render_cache.clear()
+            self.bot.db.filter_cache.invalidate()
+            self.bot.attachment_cache.invalidate()
+            if glyphs is not None:
+                glyphs.sprites.invalidate()
+                glyphs.layout.cache_clear()
+        await ctx.send(f"```\n{stats}\n```" + ("\nCleared the caches." if clear else ""))
+
+    @commands.command()
+    @commands.is_owner()
+    async def buildpack(self, ctx: Context):
+        """Packs every sprite into one memory-mapped file, so that renders don't have to open them one by one."""
+        message = await ctx.reply("Packing sprites...")
+        start = time.perf_counter()
+        count = await asyncio.to_thread(build_pack, "data/sprites", self.bot.config["sprite_pack"])
+        self.bot.renderer.sprite_cache.load_pack(self.bot.config["sprite_pack"])
+        await message.edit(content=f"Done. Packed {count} sprites in {time.perf_counter() - start:.1f} seconds.")
+
     @commands.command()
     @commands.is_owner()
     async def loadletters(self, ctx: Context):
@@ -1174,6 +1218,10 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
         )
 
     async def load_ready_letters(self):
+        # Generated text is made out of letters, so it has to be regenerated
+        await asyncio.to_thread(self.bot.renderer.tile_cache.invalidate)
+        await self.bot.renderer.render_cache.clear()
+
         def channel_shenanigans(im: Image.Image) -> Image.Image:
             if im.mode == "L":
                 return im
@@ -1212,6 +1260,7 @@ class OwnerCog(commands.Cog, name="Admin", command_attrs=dict(hidden=True)):
             ''',
             data
         )
+        await self.bot.renderer.load_glyphs()
 
     @commands.command()
     @commands.is_owner()
@@ -24,7 +24,7 @@ from discord.ext import commands
 from PIL import Image
 from src import constants
 from src.db import CustomLevelData, LevelData
-from src.utils import cached_open
+from src.sprites import SpriteCache
 from ..tile import ProcessedTile
 
 from ..types import Bot, Context, SignText, RenderContext
@@ -69,7 +69,7 @@ class Grid:
         self.author: str | None = None
 
     # noinspection PyTypeChecker
-    def ready_grid(self) -> list[list[list[ProcessedTile]]]:
+    def ready_grid(self, sprite_cache: SpriteCache) -> list[list[list[ProcessedTile]]]:
         """Returns a ready-to-paste version of the grid."""
         def is_adjacent(sprite: str, x: int, y: int) -> bool:
             valid = (sprite, "edge", "level")
@@ -80,8 +80,7 @@ class Grid:
             return any(
                 item.sprite in valid for item in self.cells[y * self.width + x])
 
-        def open_sprite(world: str, sprite: str, variant: int, wobble: int,
-                        *, cache: dict[str, Image.Image]) -> Image.Image:
+        def open_sprite(world: str, sprite: str, variant: int, wobble: int) -> Image.Image:
             """This first checks the given world, then the `baba` world, then
             `baba-extensions`, and if both fail it returns `default`"""
             if sprite == "icon":
@@ -96,18 +95,12 @@ class Grid:
             for maybe_world in (world, *constants.VANILLA_WORLDS):
                 for path in paths:
                     try:
-                        return cached_open(
-                            path.format(maybe_world),
-                            cache=cache,
-                            fn=Image.open).convert("RGBA")
+                        return Image.fromarray(sprite_cache.get(path.format(maybe_world)))
                     except FileNotFoundError:
                         continue
             else:
                 warnings.warn(f"Using default sprite! {path.format(world)}")
-                return cached_open(
-                    f"data/sprites/vanilla/default_{wobble}.png",
-                    cache=cache,
-                    fn=Image.open).convert("RGBA")
+                return Image.fromarray(sprite_cache.get(f"data/sprites/vanilla/default_{wobble}.png"))
 
         def recolor(sprite: Image.Image,
                     rgb: tuple[int, int, int]) -> Image.Image:
@@ -119,7 +112,6 @@ class Grid:
             arr[..., 2] *= b / 256
             return Image.fromarray(arr.astype('uint8'))
 
-        sprite_cache = {}
         maxstack = 1
         palette_img = Image.open(
             f"data/palettes/{self.palette}.png").convert("RGB")
@@ -154,24 +146,21 @@ class Grid:
                                     self.world,
                                     item.sprite,
                                     variant,
-                                    1,
-                                    cache=sprite_cache),
+                                    1),
                                 color)),
                             np.array(recolor(
                                 open_sprite(
                                     self.world,
                                     item.sprite,
                                     variant,
-                                    2,
-                                    cache=sprite_cache),
+                                    2),
                                 color)),
                             np.array(recolor(
                                 open_sprite(
                                     self.world,
                                     item.sprite,
                                     variant,
-                                    3,
-                                    cache=sprite_cache),
+                                    3),
                                 color)),
                         )
                         layer_grid[i][y][x] = ProcessedTile(empty=False, frames=frames)
@@ -269,7 +258,7 @@ class Reader(commands.Cog, command_attrs=dict(hidden=True)):
         grid = self.read_map(code, source="levels", data=raw_l)
         grid, sign_texts = await self.read_metadata(grid, data=raw_ld, custom=True)
 
-        objects = grid.ready_grid()
+        objects = grid.ready_grid(self.bot.renderer.sprite_cache)
         # Strips the borders from the render
         # (last must be popped before first to preserve order)
         for layer in objects:
@@ -326,7 +315,7 @@ class Reader(commands.Cog, command_attrs=dict(hidden=True)):
         # Data
         grid = self.read_map(filename, source=source)
         grid, sign_texts = await self.read_metadata(grid, initialize_level_tree=initialize)
-        objects = grid.ready_grid()
+        objects = grid.ready_grid(self.bot.renderer.sprite_cache)
 
         # Shave off the borders:
         if remove_borders:
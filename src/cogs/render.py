@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
 import functools
 import glob
+import heapq
+import itertools
 import math
 import random
 import re
 import struct
 import sys
+import threading
 import time
-import traceback
 import warnings
 import zipfile
 from io import BytesIO
 from pathlib import Path
-from typing import TYPE_CHECKING, BinaryIO, Optional
+from typing import TYPE_CHECKING, Awaitable, BinaryIO, Iterable, Iterator, Optional, TypeVar
 
 import cv2
 import numpy as np
@@ -25,7 +28,9 @@ import PIL.ImageFont as ImageFont
 from src.tile import ProcessedTile, Tile
 from .. import constants, errors
 from ..types import Color, RenderContext
-from ..utils import cached_open
+from ..render_cache import RenderCache
+from ..sprites import LRUCache, SpriteCache, TileCache
+from ..workers import RenderJob, RenderPool
 
 try:
     FONT = ImageFont.truetype("data/fonts/default.ttf")
@@ -35,6 +40,33 @@ except OSError:
 if TYPE_CHECKING:
     from ...ROBOT import Bot
 
+T = TypeVar("T")
+
+# Height in pixels of the bands that batched compositing blends at once
+COMPOSITE_BAND = 32
+# Every byte value in every channel, for running pointwise variants on instead of whole sprites
+RAMP = np.arange(256, dtype=np.uint8)[np.newaxis, :, np.newaxis].repeat(4, axis=2)
+# Number of colors each palette remembers the closest palette color of, before it starts over
+SNAP_CACHE_LIMIT = 2 ** 16
+
+
+def lookup(table: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Indexes a 256x256 table with two arrays of bytes."""
+    return table.take((a.astype(np.uint16) << 8) | b)
+
+
+def as_pixels(arr: np.ndarray) -> np.ndarray:
+    """Views an RGBA array as one 32-bit integer per pixel."""
+    if arr.strides[-1] != 1:
+        arr = np.ascontiguousarray(arr)
+    return arr.view(np.uint32)[..., 0]
+
+
+# Output alpha of a blend, indexed by canvas alpha and sprite alpha
+ALPHA_TABLE = (
+    np.arange(256)[:, np.newaxis] + np.arange(256)[np.newaxis, :] * (1 - np.arange(256)[:, np.newaxis] / 255)
+).astype(np.uint8)
+
 
 def shift_hue(arr, hueshift):
     arr_rgb, arr_a = arr[:, :, :3], arr[:, :, 3]
@@ -86,6 +118,288 @@ def get_first_frame(tile):
         return np.array((0, 0))  # Empty tile
 
 
+def pack_colors(arr: np.ndarray) -> np.ndarray:
+    """Packs the RGB channels of an array into one 32-bit integer per pixel."""
+    return (arr[..., 0].astype(np.uint32) << 16) | (arr[..., 1].astype(np.uint32) << 8) | arr[..., 2]
+
+
+def unpack_colors(packed: np.ndarray) -> np.ndarray:
+    """Inverse of `pack_colors`."""
+    return np.stack((packed >> 16, packed >> 8, packed), axis=-1).astype(np.uint8)
+
+
+class FrameQuantizer:
+    """Converts RGBA frames to paletted images one at a time, with index 0 being transparent.
+
+    Frames share one palette for as long as their colors fit in it, in which case nothing is lost.
+    After that, each frame gets its 255 most common colors, and the rest are snapped to the nearest one.
+    Only the last frame is kept in full, so memory is bounded by the paletted output.
+    """
+
+    def __init__(self):
+        # In order of appearance, so that indices given to earlier frames stay valid as it grows
+        self.colors = np.zeros(0, dtype=np.uint32)
+        self.shared = True
+        self.frames: list[tuple[np.ndarray, bytes | None]] = []
+        # Bit-packed masks of the pixels that are the same as in the frame before
+        self.unchanged: list[np.ndarray | None] = []
+        self.first_visible: np.ndarray | None = None
+        self.previous: np.ndarray | None = None
+        self.turns_clear = False
+
+    def add(self, image: np.ndarray):
+        packed = pack_colors(image)
+        visible = image[..., 3] != 0
+        if self.previous is None:
+            self.first_visible = visible
+        elif self.previous.shape != image.shape:
+            self.turns_clear = True
+            self.unchanged.append(None)
+        else:
+            self.turns_clear |= bool(np.any((self.previous[..., 3] != 0) & ~visible))
+            self.unchanged.append(np.packbits(as_pixels(self.previous) == as_pixels(image)))
+        self.previous = image
+        colors, inverse = np.unique(packed[visible], return_inverse=True)
+        if self.shared:
+            new = np.setdiff1d(colors, self.colors, assume_unique=True)
+            if len(self.colors) + len(new) <= 255:
+                self.colors = np.concatenate((self.colors, new))
+                order = np.argsort(self.colors)
+                mapping = order[np.searchsorted(self.colors, colors, sorter=order)]
+                indices = np.zeros(packed.shape, dtype=np.uint8)
+                indices[visible] = mapping[inverse] + 1
+                self.frames.append((indices, None))
+                return
+            self.shared = False
+        self.frames.append(self.quantize(packed, visible, colors, inverse))
+
+    @staticmethod
+    def quantize(packed: np.ndarray, visible: np.ndarray, colors: np.ndarray, inverse: np.ndarray):
+        counts = np.bincount(inverse, minlength=len(colors))
+        common = np.sort(colors[np.argsort(counts, kind="stable")[::-1][:255]])
+        # Map each distinct color to a palette index, instead of every pixel
+        mapping = np.searchsorted(common, colors)
+        missing = np.flatnonzero(common[np.minimum(mapping, len(common) - 1)] != colors)
+        palette_rgb = unpack_colors(common).astype(np.int32)
+        for start in range(0, len(missing), 4096):
+            chunk = missing[start:start + 4096]
+            distances = ((unpack_colors(colors[chunk]).astype(np.int32)[:, np.newaxis] - palette_rgb) ** 2).sum(axis=-1)
+            mapping[chunk] = distances.argmin(axis=1)
+        indices = np.zeros(packed.shape, dtype=np.uint8)
+        indices[visible] = mapping[inverse] + 1
+        return indices, bytes(3) + palette_rgb.astype(np.uint8).tobytes()
+
+    def finish(self, loop: bool) -> tuple[list[Image.Image], bool]:
+        """Returns the paletted frames, and whether each one is drawn over the last.
+
+        That's possible if no pixel ever turns clear, in which case
+        pixels that are the same as in the previous frame are made transparent, so that they show through from it.
+        """
+        delta = not self.turns_clear
+        if delta and loop and len(self.frames) > 1:
+            delta = self.previous.shape[:2] == self.first_visible.shape and \
+                not np.any((self.previous[..., 3] != 0) & ~self.first_visible)
+        palette = bytes(3) + unpack_colors(self.colors).tobytes()
+        save_images = []
+        for i, (indices, frame_palette) in enumerate(self.frames):
+            if delta and i:
+                unchanged = np.unpackbits(self.unchanged[i - 1], count=indices.size).reshape(indices.shape)
+                indices[unchanged.view(bool)] = 0
+            save_images.append(paletted(indices, palette if frame_palette is None else frame_palette))
+        return save_images, delta
+
+
+def stream_frames(
+        images: Iterable[np.ndarray],
+        boomerang: bool = False,
+        archive: zipfile.ZipFile | None = None,
+        name: str = 'render'
+) -> Iterator[np.ndarray]:
+    """Passes frames through as they come, then plays them back in reverse if boomeranging.
+
+    If an archive is given, each frame is also written to it as a PNG.
+    """
+    kept = []
+    i = 0
+    for image in images:
+        if boomerang:
+            kept.append(image)
+        if archive is not None:
+            archive_frame(archive, name, i, image)
+        yield image
+        i += 1
+    if len(kept) > 2:
+        for image in kept[-2:0:-1]:
+            if archive is not None:
+                archive_frame(archive, name, i, image)
+            yield image
+            i += 1
+
+
+def archive_frame(archive: zipfile.ZipFile, name: str, i: int, image: np.ndarray):
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, "PNG")
+    archive.writestr(f"{name}_{i // 3}_{(i % 3) + 1}.png", buffer.getvalue())
+
+
+def paletted(indices: np.ndarray, palette: bytes) -> Image.Image:
+    im = Image.fromarray(indices, mode="P")
+    im.putpalette(palette)
+    return im
+
+
+class GlyphAtlas:
+    """The letters that custom text is made out of, decoded once and kept in memory.
+
+    Takes rows of the `letters` table, in table order, since that order decides which letter a seed picks.
+    Text layouts and finished text sprites are cached here too, so they're dropped whenever the letters are reloaded.
+    """
+
+    def __init__(self, rows: Iterable[tuple[str, str, int, bytes, bytes, bytes]], budget: int):
+        self.widths: dict[tuple[str, str], list[int]] = {}
+        self.glyphs: dict[tuple[str, str, int], list[tuple[np.ndarray | None, ...]]] = {}
+        for mode, char, width, *sprites in rows:
+            self.widths.setdefault((mode, char), []).append(width)
+            self.glyphs.setdefault((mode, char, width), []).append(tuple(
+                None if sprite is None else np.array(Image.open(BytesIO(sprite)).convert("L")) for sprite in sprites
+            ))
+        self.sizes = {key: sorted(set(widths)) for key, widths in self.widths.items()}
+        self.layout = functools.lru_cache(maxsize=4096)(self._layout)
+        self.sprites = LRUCache(budget)
+
+    def _layout(self, text: str, mode: str, style: str) -> tuple[tuple[int, ...], tuple[tuple[int, int], ...], tuple[int, int]]:
+        """Lays out a line of custom text, returning the width of each letter,
+        where the center of the left edge of each letter goes, and the size of the sprite."""
+        raw = text.replace("/", "")
+        size = constants.DEFAULT_SPRITE_SIZE
+        if "/" in text:
+            indices = [match.start() - n for n, match in enumerate(re.finditer("/", text))]
+        elif len(raw) >= 4 and style != "oneline":
+            indices = [len(raw) - math.ceil(len(raw) / 2)]
+        else:
+            indices = []
+        bounds = list(zip([0, *indices], [*indices, len(raw)]))
+
+        def wider(c: str, w: int) -> int | None:
+            sizes = self.sizes[mode, c]
+            i = bisect.bisect_right(sizes, w)
+            return sizes[i] if i < len(sizes) else None
+
+        # Start from the narrowest letters
+        widths = []
+        for c in raw:
+            if (mode, c) not in self.sizes or wider(c, 0) is None:
+                raise errors.BadCharacter(text, mode, c)
+            widths.append(wider(c, 0))
+        max_width = max(size, *(sum(widths[a:b]) for a, b in bounds))
+
+        # Then widen the narrowest letter of each line while it still fits,
+        # until none of them can be widened
+        for a, b in bounds:
+            heap = [(widths[i], i) for i in range(a, b)]
+            heapq.heapify(heap)
+            total = sum(widths[a:b])
+            while heap:
+                old_width, i = heapq.heappop(heap)
+                new_width = wider(raw[i], old_width)
+                if new_width is None or \
+                        total - widths[b - 1] + old_width + (new_width - old_width) * (b - a) > size:
+                    continue
+                widths[i] = new_width
+                total += new_width - old_width
+                heapq.heappush(heap, (new_width, i))
+
+        # Kerning: try for 1 pixel between sprites, and rest to the edges
+        gaps: list[int] = []
+        rows = [widths[a:b] for a, b in bounds]
+        for row in rows:
+            space = max_width - sum(row)
+            # Extra -1 is here to not give kerning space outside the
+            # left/rightmost char
+            chars = len(row) - 1
+            if space >= chars:
+                # left edge
+                gaps.append((space - chars) // 2)
+                # char gap
+                gaps.extend([1] * chars)
+                # right edge gap is implied
+            else:
+                # left edge
+                gaps.append(0)
+                # as many char gaps as possible, starting from the left
+                gaps.extend([1] * space)
+                gaps.extend([0] * (chars - space))
+
+        positions = []
+        for j, (a, b) in enumerate(bounds):
+            x = gaps[a]
+            y_center = (size // 2) * j + size // 4 if mode == "small" and style != "oneline" else 12
+            for i in range(a, b):
+                positions.append((x, y_center))
+                x += widths[i]
+                if i != b - 1:
+                    x += gaps[i + 1]
+        return tuple(widths), tuple(positions), (max(max(sum(row) for row in rows), size), (max(len(rows), 2) * size) // 2)
+
+
+class PaletteSnapper:
+    """Finds the closest color of a palette to each color of a sprite, by distance in Lab space.
+
+    The closest color to each RGB value is worked out the first time it's seen, and then looked up after that.
+    Snappers are shared between render threads, so the lookup is only touched while holding a lock.
+    """
+
+    def __init__(self, palette: Image.Image):
+        self.colors = np.array(palette.convert("RGB")).reshape(-1, 3)
+        self.lab = self.to_lab(self.colors)
+        self.keys = np.empty(0, dtype=np.uint32)
+        self.indices = np.empty(0, dtype=np.intp)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def to_lab(colors: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(colors[np.newaxis].astype(np.float32) / 255, cv2.COLOR_RGB2Lab)[0]
+
+    def nearest(self, colors: np.ndarray) -> np.ndarray:
+        """Works out the index of the closest palette color to each of an array of RGB colors."""
+        # Distances are rounded down to whole numbers, with ties going to the earlier palette color
+        distances = np.sqrt(np.sum((self.to_lab(colors)[:, np.newaxis] - self.lab) ** 2, axis=-1)).astype(int)
+        return np.argmin(distances, axis=1)
+
+    def closest(self, keys: np.ndarray) -> np.ndarray:
+        """Gets the index of the closest palette color to each of a sorted array of unique packed RGB values."""
+        positions = np.searchsorted(self.keys, keys)
+        known = positions < len(self.keys)
+        known[known] = self.keys[positions[known]] == keys[known]
+        if known.all():
+            return self.indices[positions]
+        new_keys = keys[~known]
+        if len(self.keys) + len(new_keys) > SNAP_CACHE_LIMIT:
+            self.keys, self.indices = self.keys[:0], self.indices[:0]
+            new_keys = keys
+        colors = np.stack((new_keys >> 16, new_keys >> 8 & 0xFF, new_keys & 0xFF), axis=-1).astype(np.uint8)
+        keys_so_far = np.concatenate((self.keys, new_keys))
+        order = np.argsort(keys_so_far)
+        self.keys = keys_so_far[order]
+        self.indices = np.concatenate((self.indices, self.nearest(colors)))[order]
+        return self.indices[np.searchsorted(self.keys, keys)]
+
+    def snap(self, sprite: np.ndarray) -> np.ndarray:
+        if sprite.dtype == np.uint8:
+            rgb = sprite[..., :3].astype(np.uint32)
+            keys, inverse = np.unique(rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2], return_inverse=True)
+            with self._lock:
+                indices = self.closest(keys)
+        else:
+            # Some variants leave fractional colors, which are snapped exactly instead of being looked up
+            colors, inverse = np.unique(sprite[..., :3].reshape(-1, 3), axis=0, return_inverse=True)
+            indices = self.nearest(colors)
+        result = np.empty(sprite.shape, dtype=np.uint8)
+        result[..., :3] = self.colors[indices[inverse.reshape(sprite.shape[:-1])]]
+        result[..., 3] = sprite[..., 3]
+        return result
+
+
 class Renderer:
     """This class exposes various image rendering methods.
 
@@ -98,17 +412,38 @@ class Renderer:
         for path in glob.glob("data/palettes/*.png"):
             with Image.open(path) as im:
                 self.palette_cache[Path(path).stem] = im.convert("RGBA").copy()
+        self.palette_snappers: dict[str, PaletteSnapper] = {}
         self.overlay_cache = {}
         for path in glob.glob("data/overlays/*.png"):
             with Image.open(path) as im:
                 self.overlay_cache[Path(path).stem] = np.array(im.convert("RGBA"))
+        self.sprite_cache = SpriteCache(bot.config["sprite_cache_budget"])
+        self.sprite_cache.load_pack(bot.config["sprite_pack"])
+        self.tile_cache = TileCache(bot.config["tile_cache_budget"], bot.config["tile_cache_dir"])
+        self.pool = RenderPool(bot.config["render_workers"])
+        self.render_cache = RenderCache(bot.config["render_cache_dir"], bot.config["render_cache_budget"])
+        self._blend_tables = {}
+        self.glyphs: GlyphAtlas | None = None
 
     async def render(
             self,
             grid: list[list[list[list[ProcessedTile]]]],
-            ctx: RenderContext
+            ctx: RenderContext,
+            deadline: float | None = None
+    ):
+        """Takes a list of tile objects and generates a gif with the associated sprites.
+
+        The work itself is done on the render pool, so the event loop stays responsive."""
+        return await self.pool.run(self.render_sync, grid, ctx, deadline=deadline)
+
+    def render_sync(
+            self,
+            grid: list[list[list[list[ProcessedTile]]]],
+            ctx: RenderContext,
+            *,
+            job: RenderJob
     ):
-        """Takes a list of tile objects and generates a gif with the associated sprites."""
+        """Blocking implementation of `render`. Runs on a worker thread."""
         start_time = time.perf_counter()
         if ctx.animation is not None:
             animation_wobble, animation_timestep = ctx.animation
@@ -169,144 +504,19 @@ class Renderer:
         if not ctx._disable_limit:
             assert all(
                 true_size[::-1] <= constants.MAX_IMAGE_SIZE), f"Image of size `{true_size[::-1]}` is larger than the maximum allowed size of `{constants.MAX_IMAGE_SIZE}`!"
-        steps = np.zeros(
-            (((animation_timestep if animation_wobble else len(frames)) * grid.shape[0]), *default_size, 4),
-            dtype=np.uint8)
-
-        if ctx.background_images:
-            for f, frame in enumerate(frames):
-                img = Image.new("RGBA", tuple(default_size[::-1]))
-                # for loop in case multiple background images are used
-                # (i.e. baba's world map)
-                bg_img: Image.Image = ctx.background_images[(frame - 1) % len(ctx.background_images)].convert("RGBA")
-                bg_img = bg_img.resize((bg_img.width // ctx.upscale, bg_img.height // ctx.upscale), Image.NEAREST)
-                img.paste(bg_img, (0, 0), mask=bg_img)
-                for i in range(animation_wobble):
-                    q = i + animation_wobble * f
-                    steps[q] = np.array(img)
-        for t, step in enumerate(grid):
-            for z, layer in enumerate(step):
-                for y, row in enumerate(layer):
-                    for x, tile in enumerate(row):
-                        await asyncio.sleep(0)
-                        first_frame = get_first_frame(tile)
-                        if tile.empty:
-                            continue
-                        displacement = (
-                        y * ctx.spacing - int((first_frame[0] - ctx.spacing) / 2) + top - tile.displacement[1],
-                        x * ctx.spacing - int((first_frame[1] - ctx.spacing) / 2) + left - tile.displacement[0])
-                        for i, frame in enumerate(frames[animation_timestep * t:animation_timestep * (t + 1)]):
-                            image_index = i + animation_timestep * t
-                            wobble = tile.wobble_frames[
-                                min(len(tile.wobble_frames) - 1, frame - 1)] if tile.wobble_frames is not None \
-                                else (11 * x + 13 * y + frame - 1) % 3 if ctx.random_animations \
-                                else frame - 1
-                            final_wobble = functools.reduce(lambda a, b: a if b is None else b, tile.frames)
-                            image = tile.frames[wobble] if tile.frames[wobble] is not None else final_wobble
-                            dslice = (default_size - (first_frame + displacement))
-                            dst_slice = (
-                                slice(max(-displacement[0], 0), dslice[0] if dslice[0] < 0 else None),
-                                slice(max(-displacement[1], 0), dslice[1] if dslice[1] < 0 else None)
-                            )
-                            image = image[*dst_slice]
-                            if image.size < 1:
-                                continue
-                            # Get the part of the image to paste on
-                            src_slice = (
-                                slice(max(displacement[0], 0), image.shape[0] + max(displacement[0], 0)),
-                                slice(max(displacement[1], 0), image.shape[1] + max(displacement[1], 0))
-                            )
-                            index = image_index, *src_slice
-                            try:
-                                steps[index] = self.blend(tile.blending, steps[index], image, tile.keep_alpha)
-                            except IndexError:
-                                pass  # warnings.warn(f"Couldn't place {tile} at {x}, {y}, {index}")
-        background_images = [np.array(image.convert("RGBA")) for image in ctx.before_images]
-        l, u, r, d = ctx.crop
-        r = r
-        d = d
-        wobble_range = np.arange(steps.shape[0]) // animation_timestep
-        for i, step in enumerate(steps):
-            step = step[u:-d if d > 0 else None, l:-r if r > 0 else None]
-            if ctx.background is not None:
-                if len(ctx.background) < 4:
-                    ctx.background = Color.parse(Tile(palette=ctx.palette), self.palette_cache, ctx.background)
-                ctx.background = np.array(ctx.background).astype(np.float32)
-                step_f = step.astype(np.float32) / 255
-                step_f[..., :3] = step_f[..., 3, np.newaxis]
-                c = ((1 - step_f) * ctx.background + step_f * step.astype(np.float32))
-                step = c.astype(np.uint8)
-            step = cv2.resize(
-                step,
-                (int(step.shape[1] * ctx.upscale), int(step.shape[0] * ctx.upscale)),
-                interpolation=cv2.INTER_NEAREST
-            )
-            if len(ctx.sign_texts):
-                anchor_disps = {
-                    "l": 0.0,
-                    "t": 0.0,
-                    "m": 0.5,
-                    "r": 1.0,
-                    "s": 1.0,
-                    "d": 1.0
-                }
-                im = Image.new("RGBA", step.shape[1::-1])
-                draw = ImageDraw(im)
-                if ctx.image_format == "gif" and ctx.background is None:
-                    draw.fontmode = "1"
-                for sign_text in ctx.sign_texts:
-                    if wobble_range[i] in range(sign_text.time_start, sign_text.time_end):
-                        text = sign_text.text
-                        text = re.sub(r"(?<!\\)\\n", "\n", text)
-                        text = re.sub(r"\\(.)", r"\1", text)
-                        assert len(
-                            text) <= constants.MAX_SIGN_TEXT_LENGTH, f"Sign text of length {len(text)} is too long! The maximum is `{constants.MAX_SIGN_TEXT_LENGTH}`."
-                        pos = (left + sign_text.xo + (
-                                    ctx.spacing * ctx.upscale * (sign_text.x + anchor_disps[sign_text.anchor[0]])),
-                               top + sign_text.yo + (ctx.spacing * ctx.upscale * (
-                                           sign_text.y + anchor_disps[sign_text.anchor[1]])))
-                        draw.multiline_text(pos, text, font=sign_text.font,
-                                            align=sign_text.alignment, anchor=sign_text.anchor,
-                                            fill=sign_text.color, features=("liga", "dlig", "clig"),
-                                            stroke_fill=sign_text.stroke[0], stroke_width=sign_text.stroke[1])
-                sign_arr = np.array(im)
-                if ctx.image_format == "gif" and ctx.background is None:
-                    sign_arr[..., 3][sign_arr[..., 3] > 0] = 255
-                step = self.blend("normal", step, sign_arr, True)
-            if ctx.image_format == "gif":
-                step_a = step[..., 3]
-                step = np.multiply(step[..., :3], np.dstack([step_a] * 3).astype(float) / 255,
-                                   casting="unsafe").astype(np.uint8)
-                true_rgb = step.astype(float) * (step_a.astype(float) / 255).reshape(*step.shape[:2], 1)
-                too_dark_mask = np.logical_and(np.all(true_rgb < 8, axis=2), step_a != 0)
-                step[too_dark_mask, :3] = 4
-                step = np.dstack((step, step_a))
-            background_images.append(step)
-        comp_ovh = time.perf_counter() - start_time
+        setup_time = time.perf_counter() - start_time
+        elapsed = [setup_time]
         start_time = time.perf_counter()
+        images = itertools.chain(
+            (np.array(image.convert("RGBA")) for image in ctx.before_images),
+            self.composite_frames(grid, ctx, frames, animation_wobble, animation_timestep, default_size, (top, left),
+                                  elapsed, job=job)
+        )
+        first = next(images)
         if self.bot.config["debug"]:
             # Print to thermal printer (I have one for this)
-            first = background_images[0]
-            ratio = first.shape[0] / first.shape[1]
-            first = cv2.resize(
-                first,
-                (int(min(1 / ratio, 1) * 384), int(min(ratio, 1) * 384)),
-                interpolation=cv2.INTER_NEAREST
-            )
-            image = Image.fromarray(first)
-            background = Image.new("RGB", first.shape[1::-1], (0, 0, 0))
-            background.paste(image, mask=image.split()[3])
-            arr = ~np.array(background.convert("1"))
-            (height, width) = arr.shape[:2]
-            sys.stdout.buffer.write(b"\x1Dv00")
-            bytewidth = (width + 7) // 8
-            buf = struct.pack("<2H", bytewidth, height)
-            sys.stdout.buffer.write(buf)
-            packed = np.packbits(arr, axis=1)
-            sys.stdout.buffer.write(packed.tobytes())
-            sys.stdout.flush()
-
-        self.save_frames(background_images,
+            self.print_frame(first)
+        self.save_frames(itertools.chain([first], images),
                          ctx.out,
                          durations,
                          extra_out=ctx.extra_out,
@@ -315,9 +525,273 @@ class Renderer:
                          loop=ctx.loop,
                          boomerang=ctx.boomerang,
                          background=ctx.background is not None)
-        return comp_ovh, time.perf_counter() - start_time, background_images[0].shape[1::-1]
+        # Compositing and saving are interleaved, so saving gets whatever time the compositor didn't take
+        comp_ovh = elapsed[0]
+        return comp_ovh, time.perf_counter() - start_time - (comp_ovh - setup_time), first.shape[1::-1]
+
+    def composite_frames(
+            self,
+            grid: np.ndarray,
+            ctx: RenderContext,
+            frames: list[int],
+            animation_wobble: int,
+            animation_timestep: int,
+            default_size: np.ndarray,
+            origin: tuple[int, int],
+            elapsed: list[float],
+            *,
+            job: RenderJob
+    ) -> Iterator[np.ndarray]:
+        """Composites and post-processes the frames of a render one timestep at a time, yielding each when it's done.
+
+        Time spent in here is added to `elapsed`.
+        """
+        start_time = time.perf_counter()
+        top, left = origin
+        frames_per_step = animation_timestep if animation_wobble else len(frames)
+        backgrounds = {}
+        if ctx.background_images:
+            for frame in set(frames):
+                index = (frame - 1) % len(ctx.background_images)
+                if index in backgrounds:
+                    continue
+                img = Image.new("RGBA", tuple(default_size[::-1]))
+                # for loop in case multiple background images are used
+                # (i.e. baba's world map)
+                bg_img: Image.Image = ctx.background_images[index].convert("RGBA")
+                bg_img = bg_img.resize((bg_img.width // ctx.upscale, bg_img.height // ctx.upscale), Image.NEAREST)
+                img.paste(bg_img, (0, 0), mask=bg_img)
+                backgrounds[index] = np.array(img)
+        if ctx.background is not None:
+            if len(ctx.background) < 4:
+                ctx.background = Color.parse(Tile(palette=ctx.palette), self.palette_cache, ctx.background)
+            ctx.background = np.array(ctx.background).astype(np.float32)
+        l, u, r, d = ctx.crop
+        for t, timestep in enumerate(grid):
+            timestep_frames = frames[animation_timestep * t:animation_timestep * (t + 1)]
+            canvas = np.zeros((frames_per_step, *default_size, 4), dtype=np.uint8)
+            for j in range(frames_per_step):
+                # Step q shows the background of wobble frame q // animation_wobble
+                f = (frames_per_step * t + j) // animation_wobble
+                if backgrounds and f < len(frames):
+                    canvas[j] = backgrounds[(frames[f] - 1) % len(ctx.background_images)]
+            for layer in timestep:
+                job.check()
+                self.composite_layer(canvas[:len(timestep_frames)], layer, timestep_frames, ctx, (top, left))
+            for j, step in enumerate(canvas):
+                job.check()
+                i = frames_per_step * t + j
+                step = step[u:-d if d > 0 else None, l:-r if r > 0 else None]
+                if ctx.background is not None:
+                    step_f = step.astype(np.float32) / 255
+                    step_f[..., :3] = step_f[..., 3, np.newaxis]
+                    c = ((1 - step_f) * ctx.background + step_f * step.astype(np.float32))
+                    step = c.astype(np.uint8)
+                step = cv2.resize(
+                    step,
+                    (int(step.shape[1] * ctx.upscale), int(step.shape[0] * ctx.upscale)),
+                    interpolation=cv2.INTER_NEAREST
+                )
+                if len(ctx.sign_texts):
+                    anchor_disps = {
+                        "l": 0.0,
+                        "t": 0.0,
+                        "m": 0.5,
+                        "r": 1.0,
+                        "s": 1.0,
+                        "d": 1.0
+                    }
+                    im = Image.new("RGBA", step.shape[1::-1])
+                    draw = ImageDraw(im)
+                    if ctx.image_format == "gif" and ctx.background is None:
+                        draw.fontmode = "1"
+                    for sign_text in ctx.sign_texts:
+                        if i // animation_timestep in range(sign_text.time_start, sign_text.time_end):
+                            text = sign_text.text
+                            text = re.sub(r"(?<!\\)\\n", "\n", text)
+                            text = re.sub(r"\\(.)", r"\1", text)
+                            assert len(
+                                text) <= constants.MAX_SIGN_TEXT_LENGTH, f"Sign text of length {len(text)} is too long! The maximum is `{constants.MAX_SIGN_TEXT_LENGTH}`."
+                            pos = (left + sign_text.xo + (
+                                        ctx.spacing * ctx.upscale * (sign_text.x + anchor_disps[sign_text.anchor[0]])),
+                                   top + sign_text.yo + (ctx.spacing * ctx.upscale * (
+                                               sign_text.y + anchor_disps[sign_text.anchor[1]])))
+                            draw.multiline_text(pos, text, font=sign_text.font,
+                                                align=sign_text.alignment, anchor=sign_text.anchor,
+                                                fill=sign_text.color, features=("liga", "dlig", "clig"),
+                                                stroke_fill=sign_text.stroke[0], stroke_width=sign_text.stroke[1])
+                    sign_arr = np.array(im)
+                    if ctx.image_format == "gif" and ctx.background is None:
+                        sign_arr[..., 3][sign_arr[..., 3] > 0] = 255
+                    step = self.blend("normal", step, sign_arr, True)
+                if ctx.image_format == "gif":
+                    step_a = step[..., 3]
+                    step = np.multiply(step[..., :3], np.dstack([step_a] * 3).astype(float) / 255,
+                                       casting="unsafe").astype(np.uint8)
+                    true_rgb = step.astype(float) * (step_a.astype(float) / 255).reshape(*step.shape[:2], 1)
+                    too_dark_mask = np.logical_and(np.all(true_rgb < 8, axis=2), step_a != 0)
+                    step[too_dark_mask, :3] = 4
+                    step = np.dstack((step, step_a))
+                elapsed[0] += time.perf_counter() - start_time
+                yield step
+                start_time = time.perf_counter()
+        elapsed[0] += time.perf_counter() - start_time
+
+    def print_frame(self, first: np.ndarray):
+        """Prints a frame to a thermal printer, for debugging."""
+        ratio = first.shape[0] / first.shape[1]
+        first = cv2.resize(
+            first,
+            (int(min(1 / ratio, 1) * 384), int(min(ratio, 1) * 384)),
+            interpolation=cv2.INTER_NEAREST
+        )
+        image = Image.fromarray(first)
+        background = Image.new("RGB", first.shape[1::-1], (0, 0, 0))
+        background.paste(image, mask=image.split()[3])
+        arr = ~np.array(background.convert("1"))
+        (height, width) = arr.shape[:2]
+        sys.stdout.buffer.write(b"\x1Dv00")
+        bytewidth = (width + 7) // 8
+        buf = struct.pack("<2H", bytewidth, height)
+        sys.stdout.buffer.write(buf)
+        packed = np.packbits(arr, axis=1)
+        sys.stdout.buffer.write(packed.tobytes())
+        sys.stdout.flush()
+
+    def composite_layer(
+            self,
+            canvas: np.ndarray,
+            layer: list[list[ProcessedTile]],
+            frames: list[int],
+            ctx: RenderContext,
+            origin: tuple[int, int]
+    ):
+        """Blends a single layer of tiles onto a stack of frames, in place.
+
+        Tiles are sorted into passes. Each pass holds tiles that don't overlap,
+        so they're pasted onto one sheet and blended onto the canvas all at once.
+        A tile that overlaps an earlier one goes into a later pass, which keeps the
+        grid order intact where it matters.
+        """
+        top, left = origin
+        height, width = canvas.shape[1:3]
+        # The pass after the last one that touched each pixel
+        depth = np.zeros((height, width), dtype=np.int32)
+        passes: dict[tuple[int, str, bool], list[tuple[int, int, int, np.ndarray]]] = {}
+        for y, row in enumerate(layer):
+            for x, tile in enumerate(row):
+                if tile.empty:
+                    continue
+                first_frame = get_first_frame(tile)
+                displacement = (
+                    y * ctx.spacing - int((first_frame[0] - ctx.spacing) / 2) + top - tile.displacement[1],
+                    x * ctx.spacing - int((first_frame[1] - ctx.spacing) / 2) + left - tile.displacement[0])
+                dslice = (np.array((height, width)) - (first_frame + displacement))
+                dst_slice = (
+                    slice(max(-displacement[0], 0), dslice[0] if dslice[0] < 0 else None),
+                    slice(max(-displacement[1], 0), dslice[1] if dslice[1] < 0 else None)
+                )
+                y0, x0 = max(displacement[0], 0), max(displacement[1], 0)
+                final_wobble = functools.reduce(lambda a, b: a if b is None else b, tile.frames)
+                placements = []
+                for i, frame in enumerate(frames):
+                    wobble = tile.wobble_frames[
+                        min(len(tile.wobble_frames) - 1, frame - 1)] if tile.wobble_frames is not None \
+                        else (11 * x + 13 * y + frame - 1) % 3 if ctx.random_animations \
+                        else frame - 1
+                    image = tile.frames[wobble] if tile.frames[wobble] is not None else final_wobble
+                    image = image[*dst_slice]
+                    image = image[:height - y0, :width - x0]
+                    if image.size < 1:
+                        continue
+                    placements.append((i, y0, x0, image))
+                if not placements:
+                    continue
+                y1 = y0 + max(image.shape[0] for *_, image in placements)
+                x1 = x0 + max(image.shape[1] for *_, image in placements)
+                level = int(depth[y0:y1, x0:x1].max())
+                depth[y0:y1, x0:x1] = level + 1
+                passes.setdefault((level, tile.blending, tile.keep_alpha), []).extend(placements)
+        for (_, mode, keep_alpha), placements in sorted(passes.items(), key=lambda item: item[0][0]):
+            by0 = min(y0 for _, y0, _, _ in placements)
+            bx0 = min(x0 for _, _, x0, _ in placements)
+            by1 = max(y0 + image.shape[0] for _, y0, _, image in placements)
+            bx1 = max(x0 + image.shape[1] for _, _, x0, image in placements)
+            covered = sum(image.shape[0] * image.shape[1] for *_, image in placements)
+            if covered * 2 < canvas.shape[0] * (by1 - by0) * (bx1 - bx0):
+                # Too sparse to be worth a sheet, so blend each tile on its own
+                for i, y0, x0, image in placements:
+                    index = i, slice(y0, y0 + image.shape[0]), slice(x0, x0 + image.shape[1])
+                    canvas[index] = self.blend(mode, canvas[index], image, keep_alpha)
+                continue
+            sheet = np.zeros((canvas.shape[0], by1 - by0, bx1 - bx0, 4), dtype=np.uint8)
+            mask = np.zeros(sheet.shape[:3], dtype=bool)
+            for i, y0, x0, image in placements:
+                index = i, slice(y0 - by0, y0 - by0 + image.shape[0]), slice(x0 - bx0, x0 - bx0 + image.shape[1])
+                sheet[index] = image
+                mask[index] = True
+            # Blending in bands keeps the temporary arrays small
+            for band in range(0, by1 - by0, COMPOSITE_BAND):
+                rows = slice(band, band + COMPOSITE_BAND)
+                region = canvas[:, by0:by1, bx0:bx1][:, rows]
+                np.copyto(as_pixels(region), as_pixels(self.blend(mode, region, sheet[:, rows], keep_alpha)),
+                          where=mask[:, rows])
+
+    def blend_tables(self, mode: str) -> tuple[np.ndarray | None, np.ndarray | None]:
+        """Gets lookup tables for a blending mode, building them if they don't exist yet.
+
+        These hold the result of `blend_float` for every pair of color values,
+        where the sprite's pixel is fully clear and fully opaque respectively.
+        A table is `None` if it'd just give back the canvas or the sprite unchanged.
+        """
+        if mode not in self._blend_tables:
+            values = np.arange(256, dtype=np.uint8)
+            src = np.full((256, 256, 4), 255, dtype=np.uint8)
+            src[..., :3] = values[:, np.newaxis, np.newaxis]
+            dst = np.full((256, 256, 4), 255, dtype=np.uint8)
+            dst[..., :3] = values[np.newaxis, :, np.newaxis]
+            with np.errstate(all="ignore"):
+                opaque = self.blend_float(mode, src, dst)[..., 0]
+                dst[..., 3] = 0
+                clear = self.blend_float(mode, src, dst)[..., 0]
+            if np.array_equal(opaque, np.broadcast_to(values, opaque.shape)):
+                opaque = None
+            if np.array_equal(clear, np.broadcast_to(values[:, np.newaxis], clear.shape)):
+                clear = None
+            self._blend_tables[mode] = clear, opaque
+        return self._blend_tables[mode]
 
     def blend(self, mode, src, dst, keep_alpha: bool = True) -> np.ndarray:
+        """Blends a sprite (`dst`) onto a canvas (`src`).
+
+        Pixels where the sprite is fully clear or opaque are looked up in tables,
+        so only partially transparent pixels go through the floating point math.
+        The output is identical to `blend_float`."""
+        keep_alpha &= mode not in ("mask", "cut", "xora")
+        if not keep_alpha or src.dtype != np.uint8 or dst.dtype != np.uint8:
+            return self.blend_float(mode, src, dst, keep_alpha)
+        clear_table, opaque_table = self.blend_tables(mode)
+        src_a, dst_a = src[..., 3], dst[..., 3]
+        opaque = dst_a == 255
+        # Start off with whichever side shows through, a whole pixel at a time
+        out = np.where(opaque, as_pixels(dst), as_pixels(src)).view(np.uint8).reshape(src.shape)
+        if clear_table is not None or opaque_table is not None:
+            src_rgb, dst_rgb = src[..., :3], dst[..., :3]
+            out[..., :3] = np.where(
+                opaque[..., np.newaxis],
+                dst_rgb if opaque_table is None else lookup(opaque_table, src_rgb, dst_rgb),
+                src_rgb if clear_table is None else lookup(clear_table, src_rgb, dst_rgb)
+            )
+        out[..., 3] = lookup(ALPHA_TABLE, src_a, dst_a)
+        partial = (dst_a != 0) & ~opaque
+        if partial.any():
+            with np.errstate(all="ignore"):
+                out[partial] = self.blend_float(mode, src[partial], dst[partial])
+        np.copyto(as_pixels(out), 0, where=out[..., 3] == 0)
+        return out
+
+    def blend_float(self, mode, src, dst, keep_alpha: bool = True) -> np.ndarray:
+        """Reference implementation of `blend`, in floating point."""
         keep_alpha &= mode not in ("mask", "cut", "xora")
         if keep_alpha:
             out_a = (src[..., 3] + dst[..., 3] * (1 - src[..., 3] / 255)).astype(np.uint8)
@@ -369,20 +843,20 @@ class Renderer:
             raise AssertionError(f"Blending mode `{mode}` isn't implemented yet.")
         if keep_alpha:
             dst_alpha = dst[..., 3].astype(float) / 255
-            dst_alpha = dst_alpha[:, :, np.newaxis]
+            dst_alpha = dst_alpha[..., np.newaxis]
             c = ((1 - dst_alpha) * a + dst_alpha * c)
             c[out_a == 0] = 0
-            return np.dstack((np.clip(c * 255, 0, 255).astype(np.uint8), out_a[..., np.newaxis]))
+            return np.concatenate((np.clip(c * 255, 0, 255).astype(np.uint8), out_a[..., np.newaxis]), axis=-1)
         return np.clip(c * 255, 0, 255).astype(np.uint8)
 
-    async def render_full_frame(self,
-                                tile: Tile,
-                                frame: int,
-                                raw_sprite_cache: dict[str, Image.Image],
-                                x: int,
-                                y: int,
-                                ctx: RenderContext
-                                ) -> Image.Image:
+    async def load_frame(self,
+                         tile: Tile,
+                         frame: int,
+                         x: int,
+                         y: int,
+                         ctx: RenderContext
+                         ) -> np.ndarray:
+        """Gets one of the tile's wobble frames, scaled but without variants applied."""
         sprite = None
         if tile.custom:
             if type(tile.sprite) == tuple:
@@ -407,19 +881,12 @@ class Renderer:
                 elif tile.name == "default":
                     path = f"data/sprites/{source}/default_{frame + 1}.png"
             try:
-                sprite = cached_open(
-                    path, cache=raw_sprite_cache, fn=Image.open).convert("RGBA")
+                sprite = self.sprite_cache.get(path)
             except (FileNotFoundError, AssertionError):
                 raise AssertionError(f'The tile `{tile.name}:{tile.frame}` was found, but the files '
                                          f'don\'t exist for it.\nThis is a bug - please notify the author of the tile.\nSearched path: `{path}`')
-            sprite = np.array(sprite)
-        sprite = cv2.resize(sprite, (int(sprite.shape[1] * ctx.gscale), int(sprite.shape[0] * ctx.gscale)),
-                            interpolation=cv2.INTER_NEAREST)
-        return await self.apply_options_name(
-            tile,
-            sprite,
-            frame
-        )
+        return cv2.resize(sprite, (int(sprite.shape[1] * ctx.gscale), int(sprite.shape[0] * ctx.gscale)),
+                          interpolation=cv2.INTER_NEAREST)
 
     async def render_full_tile(self,
                                tile: Tile,
@@ -435,10 +902,14 @@ class Renderer:
         x, y = position
 
         rendered_frames = []
-        tile_hash = hash(tile)
+        tile_hash = tile.digest()
+        # Generated text picks its letters based on where it is, so it's only shared across renders in place
+        shared_key = f"{tile_hash}-{ctx.gscale}" + (f"-{x}-{y}" if tile.custom and type(tile.sprite) == tuple else "")
         cached = tile_hash in ctx.tile_cache.keys()
         if cached:
             final_tile.frames = ctx.tile_cache[tile_hash]
+        else:
+            final_tile.frames = self.tile_cache.get(shared_key) or final_tile.frames
         final_tile.wobble_frames = tile.wobble_frames
         done_frames = [frame is not None for frame in final_tile.frames]
         frame_range = tuple(set(tile.wobble_frames)) if tile.wobble_frames is not None \
@@ -449,16 +920,35 @@ class Renderer:
                 min(len(final_tile.wobble_frames) - 1, frame)] if final_tile.wobble_frames is not None \
                 else (11 * x + 13 * y + frame) % 3 if ctx.random_animations \
                 else frame
-            if not done_frames[wobble]:
-                final_tile.frames[wobble] = await self.render_full_frame(tile, wobble, ctx.sprite_cache, x, y, ctx)
+            if not done_frames[wobble] and wobble not in rendered_frames:
                 rendered_frames.append(wobble)
+        if rendered_frames:
+            sprites = [await self.load_frame(tile, wobble, x, y, ctx) for wobble in rendered_frames]
+            sprites = await self.apply_options_name(tile, sprites, rendered_frames)
+            for wobble, sprite in zip(rendered_frames, sprites):
+                final_tile.frames[wobble] = sprite
         if not cached:
             ctx.tile_cache[tile_hash] = final_tile.frames.copy()
+        if rendered_frames and not cached:
+            self.tile_cache.store(shared_key, final_tile.frames)
         return final_tile, rendered_frames, cached
 
-    async def render_full_tiles(self, grid: list[list[list[list[Tile]]]], ctx: RenderContext) -> tuple[
+    async def render_full_tiles(self, grid: list[list[list[list[Tile]]]], ctx: RenderContext,
+                                deadline: float | None = None) -> tuple[
+        list[list[list[list[ProcessedTile]]]], int, int, float]:
+        """Final individual tile processing step.
+
+        The work itself is done on the render pool, so the event loop stays responsive."""
+        return await self.pool.run(self.render_full_tiles_sync, grid, ctx, deadline=deadline)
+
+    def render_full_tiles_sync(self, grid: list[list[list[list[Tile]]]], ctx: RenderContext, *, job: RenderJob):
+        """Blocking implementation of `render_full_tiles`. Runs on a worker thread.
+
+        Variants are coroutines, so they're run in an event loop of the worker's own."""
+        return asyncio.run(self.process_tiles(grid, ctx, job))
+
+    async def process_tiles(self, grid: list[list[list[list[Tile]]]], ctx: RenderContext, job: RenderJob) -> tuple[
         list[list[list[list[ProcessedTile]]]], int, int, float]:
-        """Final individual tile processing step."""
         rendered_frames = 0
         d = []
         render_overhead = time.perf_counter()
@@ -469,6 +959,8 @@ class Renderer:
                 for y, row in enumerate(layer):
                     c = []
                     for x, tile in enumerate(row):
+                        # Lets timeouts cancel long renders
+                        job.check()
                         processed_tile, new_frames, cached = await self.render_full_tile(
                             tile,
                             position=(x, y),
@@ -485,6 +977,28 @@ class Renderer:
             d.append(a)
         return d, len(ctx.tile_cache), rendered_frames, time.perf_counter() - render_overhead
 
+    async def on_bot_loop(self, coro: Awaitable[T]) -> T:
+        """Awaits a coroutine on the bot's event loop.
+
+        The database and HTTP session belong to that loop, so render workers go through this to use them."""
+        loop = self.bot.loop
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def palette_snapper(self, palette: str) -> PaletteSnapper:
+        """Gets the palette snapper for a palette, making it the first time it's needed."""
+        snapper = self.palette_snappers.get(palette)
+        if snapper is None:
+            snapper = self.palette_snappers.setdefault(palette, PaletteSnapper(self.palette_cache[palette]))
+        return snapper
+
+    async def load_glyphs(self):
+        """Loads the letters table into the glyph atlas."""
+        rows = await self.bot.db.conn.fetchall('SELECT mode, char, width, sprite_0, sprite_1, sprite_2 FROM letters;')
+        self.glyphs = await asyncio.to_thread(
+            GlyphAtlas, [tuple(row) for row in rows], self.bot.config["text_cache_budget"])
+
     async def generate_sprite(
             self,
             tile: Tile,
@@ -498,199 +1012,46 @@ class Renderer:
         """Generates a custom text sprite."""
         text = tile.name[5:].lower().replace(" ", "~")
         raw = text.replace("/", "")
-        newline_count = text.count("/")
         assert len(text) <= 64, 'Text has a maximum length of `64` characters.'
         if seed is None:
             seed = int((7 + position[0]) / (3 + position[1]) * 100000000)
-        seed_digits = [(seed >> 8 * i) | 0b11111111 for i in range(len(raw))]
-        # Get mode and split status
-        if newline_count >= 1:
-            fixed = True
-            mode = "small"
-            indices = []
-            offset = 0
-            for match in re.finditer("/", text):
-                indices.append(match.start() + offset)
-                offset -= 1
-        else:
-            fixed = False
-            mode = "big"
-            indices = []
-            if len(raw) >= 4:
-                mode = "small"
-                if tile.style != "oneline":
-                    indices = [len(raw) - math.ceil(len(raw) / 2)]
-        indices.insert(0, 0)
-        indices.append(len(raw))  # can't use -1 here because of a range() later on
-
-        if style == "letter":
-            if mode == "big":
-                mode = "letter"
-
-        width_cache: dict[str, list[int]] = {}
-        for c in raw:
-            rows = await self.bot.db.conn.fetchall(
-                '''
-                SELECT char, width FROM letters
-                WHERE char == ? AND mode == ?;
-                ''',
-                c, mode
-            )
+        mode = "small" if "/" in text or len(raw) >= 4 else "letter" if style == "letter" else "big"
 
-            for row in rows:
-                char, width = row
-                width_cache.setdefault(char, []).append(width)
+        if self.glyphs is None:
+            await self.on_bot_loop(self.load_glyphs())
+        glyphs = self.glyphs
+        key = repr((text, style, seed, int(wobble), ctx.gscale))
+        sprite = glyphs.sprites.lookup(key)
+        if sprite is not None:
+            return sprite
 
-        def width_greater_than(c: str, w: int = 0) -> int:
-            try:
-                return min(width for width in width_cache[c] if width > w)
-            except ValueError:
-                raise KeyError
-
-        # fetch the minimum possible widths first
-        try:
-            widths: list[int] = [width_greater_than(c) for c in raw]
-        except KeyError as e:
-            traceback.print_exc()
-            raise errors.BadCharacter(text, mode, e.args[0])
-
-        max_width = constants.DEFAULT_SPRITE_SIZE
-        old_index = 0
-        for index in indices:
-            max_width = max(max_width, sum(widths[old_index:index]))
-            old_index = index
-
-        def check_or_adjust(widths: list[int], indices: list[int]) -> list[int]:
-            """Is the arrangement valid?"""
-            if mode == "small":
-                if not fixed:
-                    for i in range(1, len(indices) - 1):
-                        width_distance = (
-                                sum(widths[indices[i]:indices[i + 1]]) - sum(widths[indices[i - 1]:indices[i]]))
-                        old_wd = width_distance
-                        debug_flag = 0
-                        while old_wd > width_distance:
-                            debug_flag += 1
-                            indices[i] -= 1
-                            new_width_distance = (
-                                    sum(widths[indices[i]:indices[i + 1]]) - sum(widths[indices[i - 1]:indices[i]]))
-                            if new_width_distance > width_distance:
-                                indices[i] += 2
-                            assert debug_flag > 200, "Ran into an infinite loop while trying to create a text! " \
-                                                     "This shouldn't happen."
-            return indices
-
-        # Check if the arrangement is valid with minimum sizes
-        # If allowed, shift the index to make the arrangement valid
-        indices = check_or_adjust(widths, indices)
-
-        # Expand widths where possible
-        stable = [False for _ in range(len(widths))]
-        while not all(stable):
-            old_width, i = min((w, i)
-                               for i, w in enumerate(widths) if not stable[i])
-            try:
-                new_width = width_greater_than(raw[i], old_width)
-                a = max([0] if not len(max_list := [j for j in indices if i >= j]) else max_list)
-                b = min([len(indices)] if not len(min_list := [j for j in indices if i < j]) else min_list)
-                temp_widths = widths[:i] + [old_width + (new_width - old_width) * (b - a)] + widths[i:]  # BAD
-                assert sum(temp_widths[a:b]) <= constants.DEFAULT_SPRITE_SIZE
-            except (KeyError, AssertionError):
-                stable[i] = True
-                continue
-            widths[i] = new_width
-            try:
-                indices = check_or_adjust(widths, indices)
-            except errors.CustomTextTooLong:
-                widths[i] = old_width
-                stable[i] = True
-
-        # Arrangement is now the widest it can be
-        # Kerning: try for 1 pixel between sprites, and rest to the edges
-        gaps: list[int] = []
-        bounds: list[tuple(int, int)] = list(zip(indices[:-1], indices[1:]))
-        if mode == "small":
-            rows = [widths[a:b] for a, b in bounds]
-        else:
-            rows = [widths[:]]
-        for row in rows:
-            space = max_width - sum(row)
-            # Extra -1 is here to not give kerning space outside the
-            # left/rightmost char
-            chars = len(row) - 1
-            if space >= chars:
-                # left edge
-                gaps.append((space - chars) // 2)
-                # char gap
-                gaps.extend([1] * chars)
-                # right edge gap is implied
-            else:
-                # left edge
-                gaps.append(0)
-                # as many char gaps as possible, starting from the left
-                gaps.extend([1] * space)
-                gaps.extend([0] * (chars - space))
-
-        letters: list[Image.Image] = []
-        for c, seed_digit, width in zip(raw, seed_digits, widths):
-            l_rows = await self.bot.db.conn.fetchall(
-                # fstring use safe
-                f'''
-                SELECT sprite_{int(wobble)} FROM letters
-                WHERE char == ? AND mode == ? AND width == ?
-                ''',
-                c, mode, width
-            )
-            options = list(l_rows)
-            letter_sprite, *_ = *options[seed_digit % len(options)],
-            buf = BytesIO(letter_sprite)
-            letters.append(Image.open(buf))
-
-        sprite = Image.new("L",
-                           (max(max(sum(row) for row in rows),
-                                constants.DEFAULT_SPRITE_SIZE),
-                            (max(len(rows), 2) * constants.DEFAULT_SPRITE_SIZE) // 2))
-        if mode == "small":
-            for j, (a, b) in enumerate(bounds):
-                x = gaps[a]
-                y_center = ((constants.DEFAULT_SPRITE_SIZE // 2) * j) + (constants.DEFAULT_SPRITE_SIZE // 4) \
-                    if style != "oneline" else 12
-                for i in range(a, b):
-                    letter = letters[i]
-                    y_top = y_center - letter.height // 2
-                    sprite.paste(letter, (x, y_top), mask=letter)
-                    x += widths[i]
-                    if i != b - 1:
-                        x += gaps[i + 1]
-        else:
-            x = gaps[0]
-            y_center = 12
-            for i in range(len(raw)):
-                letter = letters[i]
-                y_top = y_center - letter.height // 2
-                sprite.paste(letter, (x, y_top), mask=letter)
-                x += widths[i]
-                if i != len(raw) - 1:
-                    x += gaps[i + 1]
+        widths, positions, size = glyphs.layout(text, mode, style)
+        sprite = Image.new("L", size)
+        for i, (c, width, (x, y_center)) in enumerate(zip(raw, widths, positions)):
+            options = glyphs.glyphs[mode, c, width]
+            letter = Image.fromarray(options[((seed >> 8 * i) | 0b11111111) % len(options)][int(wobble)])
+            sprite.paste(letter, (x, y_center - letter.height // 2), mask=letter)
 
         sprite = Image.merge("RGBA", (sprite, sprite, sprite, sprite))
-        sprite = sprite.resize(
-            (int(sprite.width * ctx.gscale), int(sprite.height * ctx.gscale)), Image.NEAREST)
-        return np.array(sprite)
+        sprite = np.array(sprite.resize(
+            (int(sprite.width * ctx.gscale), int(sprite.height * ctx.gscale)), Image.NEAREST))
+        sprite.flags.writeable = False
+        glyphs.sprites.store(key, sprite, sprite.nbytes)
+        return sprite
 
     async def apply_options_name(
             self,
             tile: Tile,
-            sprite: np.ndarray,
-            wobble: int
-    ) -> Image.Image:
-        """Takes an image, taking tile data from its name, and applies the
-        given options to it."""
+            sprites: list[np.ndarray],
+            wobbles: list[int]
+    ) -> list[np.ndarray]:
+        """Takes the tile's wobble frames, taking tile data from its name, and applies the
+        given options to them."""
         try:
             return await self.apply_options(
                 tile,
-                sprite,
-                wobble
+                sprites,
+                wobbles
             )
         except ValueError as e:
             size = e.args[0]
@@ -699,20 +1060,54 @@ class Renderer:
     async def apply_options(
             self,
             tile: Tile,
-            sprite: np.ndarray,
-            wobble: int,
+            sprites: list[np.ndarray],
+            wobbles: list[int],
             seed: int | None = None
-    ):
+    ) -> list[np.ndarray]:
+        """Applies the tile's sprite variants to each of the given wobble frames.
+
+        Batched variants are given every frame at once, stacked along a new first axis, if they're the same shape.
+        """
         random.seed(seed)
+        # Runs of pointwise variants are applied to a ramp, which then maps the sprites in one lookup
+        ramp = None
+        batch = None
         for variant in tile.variants["sprite"]:
-            sprite = await variant.apply(sprite, tile=tile, wobble=wobble, renderer=self)  # NOUN/PROP ARE ANNOYING
-            if not all(np.array(sprite.shape[:2]) <= constants.MAX_TILE_SIZE):
-                raise errors.TooLargeTile(sprite.shape[1::-1])
-        return sprite
+            if variant.pointwise and all(sprite.dtype == np.uint8 for sprite in sprites):
+                ramp = await variant.apply(RAMP.copy() if ramp is None else ramp,
+                                           tile=tile, wobble=None, renderer=self)
+                continue
+            if ramp is not None:
+                sprites, batch, ramp = self.apply_ramp(sprites, batch, ramp), None, None
+            if variant.batched and batch is None and len(sprites) > 1 and all(
+                    sprite.shape == sprites[0].shape and sprite.dtype == sprites[0].dtype for sprite in sprites):
+                batch = np.stack(sprites)
+            if variant.batched and batch is not None:
+                batch = await variant.apply(batch, tile=tile, wobble=None, renderer=self)
+                sprites = list(batch)
+            else:
+                batch = None
+                sprites = [
+                    await variant.apply(sprite, tile=tile, wobble=wobble, renderer=self)  # NOUN/PROP ARE ANNOYING
+                    for sprite, wobble in zip(sprites, wobbles)
+                ]
+            for sprite in sprites:
+                if not all(np.array(sprite.shape[:2]) <= constants.MAX_TILE_SIZE):
+                    raise errors.TooLargeTile(sprite.shape[1::-1])
+        if ramp is not None:
+            sprites = self.apply_ramp(sprites, batch, ramp)
+        return sprites
+
+    @staticmethod
+    def apply_ramp(sprites: list[np.ndarray], batch: np.ndarray | None, ramp: np.ndarray) -> list[np.ndarray]:
+        """Maps each channel of the sprites through a ramp, all at once if they're already stacked."""
+        if batch is None:
+            return [cv2.LUT(sprite, ramp) for sprite in sprites]
+        return list(cv2.LUT(batch.reshape(-1, *batch.shape[2:]), ramp).reshape(batch.shape))
 
     def save_frames(
             self,
-            images: list[np.ndarray],
+            images: Iterable[np.ndarray],
             out: str | BinaryIO,
             durations: list[int],
             extra_out: str | BinaryIO | None = None,
@@ -724,31 +1119,22 @@ class Renderer:
     ) -> None:
         """Saves the images as a gif to the given file or buffer.
 
+        Frames are encoded as they come in, so `images` can be a generator.
         If a buffer, this also conveniently seeks to the start of the
         buffer. If extra_out is provided, the frames are also saved as a
         zip file there.
         """
-        if boomerang and len(images) > 2:
-            images += images[-2:0:-1]
+        if extra_name is None:
+            extra_name = 'render'
+        if boomerang and len(durations) > 2:
             durations += durations[-2:0:-1]
+        file = zipfile.PyZipFile(extra_out, "x") if extra_out is not None else None
+        images = stream_frames(images, boomerang, file, extra_name)
         if image_format == 'gif':
-            if background:
-                save_images = [Image.fromarray(im) for im in images]
-            else:
-                save_images = []
-                for i, im in enumerate(images):
-                    # TODO: THIS IS EXTREMELY SLOW. BETTER WAY IS NEEDED.
-                    colors, counts = np.unique(im.reshape(-1, 4), axis=0, return_counts=True)
-                    sort_indices = np.argsort(counts)
-                    colors = colors[sort_indices[::-1]] # Sort in descending order
-                    palette_colors = [0, 0, 0]
-                    formatted_colors = colors[colors[:, 3] != 0][..., :3]
-                    formatted_colors = formatted_colors[:255].flatten()
-                    palette_colors.extend(formatted_colors)
-                    dummy = Image.new('P', (16, 16))
-                    dummy.putpalette(palette_colors)
-                    save_images.append(Image.fromarray(im).convert('RGB').quantize(
-                        palette=dummy, dither=0))
+            quantizer = FrameQuantizer()
+            for image in images:
+                quantizer.add(image)
+            save_images, delta = quantizer.finish(loop)
             kwargs = {
                 'format': "GIF",
                 'interlace': True,
@@ -763,7 +1149,9 @@ class Renderer:
             }
             if not loop:
                 del kwargs['loop']
-            if background:
+            if delta:
+                kwargs['disposal'] = 1  # Frames are drawn over each other
+            elif background:
                 del kwargs['transparency']
                 del kwargs['background']
                 del kwargs['disposal']
@@ -772,6 +1160,7 @@ class Renderer:
                 **kwargs
             )
         elif image_format == 'png':
+            # Pillow scans the frames for their modes before writing them, so they can't be a generator here
             save_images = [Image.fromarray(im) for im in images]
             kwargs = {
                 'format': "PNG",
@@ -789,18 +1178,13 @@ class Renderer:
             )
         if not isinstance(out, str):
             out.seek(0)
-        if extra_name is None:
-            extra_name = 'render'
-        if extra_out is not None:
-            file = zipfile.PyZipFile(extra_out, "x")
-            for i, img in enumerate(images):
-                buffer = BytesIO()
-                Image.fromarray(img).save(buffer, "PNG")
-                file.writestr(
-                    f"{extra_name}_{i // 3}_{(i % 3) + 1}.png",
-                    buffer.getvalue())
+        if file is not None:
             file.close()
 
 
 async def setup(bot: Bot):
     bot.renderer = Renderer(bot)
+
+
+async def teardown(bot: Bot):
+    bot.renderer.pool.shutdown()
@@ -1,6 +1,8 @@
+import functools
 import glob
 import inspect
 import math
+import re
 import types
 import typing
 from typing import Any, Literal, Optional, Union, get_origin, get_args, Callable, Iterable
@@ -27,6 +29,16 @@ META_KERNELS = {
 }
 
 
+def meta_distance(region: np.ndarray, kernel: str, size: int) -> np.ndarray:
+    """How many applications of a meta kernel it takes to reach each pixel from a region."""
+    if not region.any():
+        return np.full(region.shape, np.inf)
+    outside = np.uint8(~region)
+    if kernel == "full":
+        return np.ceil(cv2.distanceTransform(outside, cv2.DIST_C, 3) / size)
+    return cv2.distanceTransform(outside, cv2.DIST_L1, 3)
+
+
 def class_init(self, *args, **kwargs):
     self.args = args
     self.kwargs = kwargs
@@ -74,6 +86,49 @@ def parse_signature(v: list[str], t: list[type | types.GenericAlias]) -> list[An
     return out
 
 
+class VariantDispatcher:
+    """Looks up variants by the raw strings that select them, e.g. `color/red`.
+
+    Variants with plain aliases are indexed by them, so only the patterns of variants
+    whose alias starts the string are tried, along with those that can't be indexed.
+    Like a RegexDict, earlier variants take precedence.
+    """
+
+    def __init__(self, variants: Iterable[type[Variant]], cache_size: int = 4096):
+        self._values = list(variants)
+        self._compiled = [re.compile(variant.pattern) for variant in self._values]
+        self._by_alias: dict[str, list[int]] = {}
+        self._unindexed: list[int] = []
+        for i, variant in enumerate(self._values):
+            if len(variant.name) and all(len(alias) and re.escape(alias) == alias for alias in variant.name):
+                for alias in variant.name:
+                    self._by_alias.setdefault(alias, []).append(i)
+            else:
+                self._unindexed.append(i)
+        self._longest_alias = max(map(len, self._by_alias), default=0)
+        # Parsed variants don't change once they're made, so they can be shared between tiles
+        self.parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+    def get_with_match(self, key: str) -> tuple[type[Variant], re.Match]:
+        """Returns the variant selected by a string and the match of its pattern, raising KeyError if there isn't one."""
+        candidates = set(self._unindexed)
+        for end in range(1, min(len(key), self._longest_alias) + 1):
+            candidates.update(self._by_alias.get(key[:end], ()))
+        for i in sorted(candidates):
+            match = self._compiled[i].fullmatch(key)
+            if match is not None:
+                return self._values[i], match
+        raise KeyError(key)
+
+    def __getitem__(self, key: str) -> type[Variant]:
+        return self.get_with_match(key)[0]
+
+    def _parse(self, key: str) -> Variant:
+        variant, match = self.get_with_match(key)
+        args = [group for group in match.groups() if group is not None]
+        return variant(*parse_signature(args, variant.signature))
+
+
 def check_size(*dst_size):
     if dst_size[0] > constants.MAX_TILE_SIZE or dst_size[1] > constants.MAX_TILE_SIZE:
         raise errors.TooLargeTile(dst_size)
@@ -156,8 +211,8 @@ async def setup(bot):
                 tree.append(p.annotation)
         return tree
 
-    def create_variant(func: Callable, aliases: Iterable[str], no_function_name=False, hashed=True, hidden=False) -> \
-    type[Variant]:
+    def create_variant(func: Callable, aliases: Iterable[str], no_function_name=False, hashed=True, hidden=False,
+                       pointwise=False, batched=False) -> type[Variant]:
         assert func.__doc__ is not None, f"Variant `{func.__name__}` is missing a docstring!"
         sig = inspect.signature(func)
         params = sig.parameters
@@ -187,15 +242,18 @@ async def setup(bot):
                 "type": variant_type,
                 "hashed": hashed,
                 "hidden": hidden,
+                "pointwise": pointwise,
+                "batched": batched,
                 "name": aliases
             }
         )
         bot.variants.append(variant)
         return variant
 
-    def add_variant(*aliases, no_function_name=False, debug=False, hashed=True, hidden=False):
+    def add_variant(*aliases, no_function_name=False, debug=False, hashed=True, hidden=False, pointwise=False,
+                    batched=False):
         def wrapper(func):
-            v = create_variant(func, aliases, no_function_name, hashed, hidden)
+            v = create_variant(func, aliases, no_function_name, hashed, hidden, pointwise, batched)
             if debug:
                 print(f"""{v.__name__}:
     pattern: {v.pattern},
@@ -328,7 +386,7 @@ async def setup(bot):
         assert palette in palette_names, f"Palette `{palette}` was not found!"
         tile.palette = palette
 
-    @add_variant("ac", "~")
+    @add_variant("ac", "~", pointwise=True)
     async def apply(sprite, *, tile, wobble, renderer):
         """Immediately applies the sprite's default color."""
         tile.custom_color = True
@@ -342,7 +400,7 @@ async def setup(bot):
         assert len(color) == 2, "Can't override the default with a hexadecimal color!"
         tile.color = tuple(color)
 
-    @add_variant(no_function_name=True)
+    @add_variant(no_function_name=True, pointwise=True)
     async def color(sprite, color: Color, inactive: Optional[Literal["inactive", "in"]] = None, *, tile, wobble, renderer, _default_color = False):
         """Sets the tile's color.
 Can take:
@@ -486,7 +544,7 @@ If [0;36mextrapolate[0m is on, then colors outside the gradient will be extrap
 
     # --- FILTERS ---
 
-    @add_variant()
+    @add_variant(batched=True)
     async def hide(sprite):
         """Hides the tile."""
         sprite[..., 3] = 0
@@ -565,20 +623,20 @@ If [0;36mextrapolate[0m is on, then colors outside the gradient will be extrap
             "lanczos": cv2.INTER_LANCZOS4
         }[interpolation])[:, ::-1]
 
-    @add_variant()
+    @add_variant(batched=True)
     async def pad(sprite, left: int, top: int, right: int, bottom: int):
         """Pads the sprite by the specified values."""
-        check_size(sprite.shape[1] + max(left, 0) + max(right, 0), sprite.shape[0] + max(top, 0) + max(bottom, 0))
-        return np.pad(sprite, ((top, bottom), (left, right), (0, 0)))
+        check_size(sprite.shape[-2] + max(left, 0) + max(right, 0), sprite.shape[-3] + max(top, 0) + max(bottom, 0))
+        return np.pad(sprite, ((0, 0),) * (sprite.ndim - 3) + ((top, bottom), (left, right), (0, 0)))
 
-    @add_variant("px")
+    @add_variant("px", batched=True)
     async def pixelate(sprite, x: int, y: Optional[int] = None):
         """Pixelates the sprite."""
         if y is None:
             y = x
-        return sprite[y - 1::y, x - 1::x].repeat(y, axis=0).repeat(x, axis=1)
+        return sprite[..., y - 1::y, x - 1::x, :].repeat(y, axis=-3).repeat(x, axis=-2)
 
-    @add_variant()
+    @add_variant(pointwise=True)
     async def posterize(sprite, bands: int):
         """Posterizes the sprite."""
         sprite = np.dstack([np.digitize(sprite[..., i], np.linspace(0, 255, bands)) * (255 / bands) for i in range(4)])
@@ -599,18 +657,30 @@ If [0;36mextrapolate[0m is on, then colors outside the gradient will be extrap
         base = orig[..., 3]
         if level < 0:
             base = 255 - base
-        ksize = 2*size + 1
-        ker = np.ones((ksize, ksize))
-        if kernel == 'full':
-            ker[size, size] = - ksize**2 + 1
-        elif kernel == 'edge':
-            ker[size, size] = - ksize**2 + 5
-            ker[0,0] = 0
-            ker[0,ksize-1] = 0
-            ker[ksize-1,ksize-1] = 0
-            ker[ksize-1,0] = 0
-        for _ in range(abs(level)):
-            base = cv2.filter2D(src=base, ddepth=-1, kernel=ker)
+        depth = abs(level)
+        # Only the full kernel and the smallest edge kernel have distance transforms
+        if depth > 1 and (kernel == "full" or size == 1) and min(base.shape) > size and \
+                np.count_nonzero(base) == np.count_nonzero(base == 255):
+            # Meta outlines an opaque shape, then outlines the outline, and so on.
+            # Each pixel first lights up once the outlines reach it, then every other step after that.
+            region = base == 255
+            steps = np.where(region, meta_distance(~region, kernel, size) + 1, meta_distance(region, kernel, size))
+            lit = steps <= depth
+            lit[lit] = (depth - steps[lit]) % 2 == 0
+            base = np.uint8(lit) * np.uint8(255)
+        else:
+            ksize = 2*size + 1
+            ker = np.ones((ksize, ksize))
+            if kernel == 'full':
+                ker[size, size] = - ksize**2 + 1
+            elif kernel == 'edge':
+                ker[size, size] = - ksize**2 + 5
+                ker[0,0] = 0
+                ker[0,ksize-1] = 0
+                ker[ksize-1,ksize-1] = 0
+                ker[ksize-1,0] = 0
+            for _ in range(depth):
+                base = cv2.filter2D(src=base, ddepth=-1, kernel=ker)
         base = np.dstack((base, base, base, base))
         mask = orig[..., 3] > 0
         if not (level % 2) and level > 0:
@@ -628,15 +698,9 @@ If [0;36mextrapolate[0m is on, then colors outside the gradient will be extrap
             num = 1
         nsprite = await meta(sprite, num)
         sprite = await pad(sprite, num, num, num, num)
-        for i in range(nsprite.shape[0]):
-            for j in range(nsprite.shape[1]):
-                if nsprite[i, j, 3] == 0:
-                    try:
-                        nsprite[i, j] = sprite[i, j]
-                    except:
-                        pass
-                else:
-                    nsprite[i, j, 3] = opvalue
+        outline = nsprite[..., 3] != 0
+        nsprite[~outline] = sprite[~outline]
+        nsprite[outline, 3] = opvalue
         return nsprite
 
     @add_variant()
@@ -766,14 +830,14 @@ If [0;36mextrapolate[0m is on, then colors outside the gradient will be extrap
             mask = mask.T
         return np.dstack((sprite[:, :, :3], sprite[:, :, 3] * mask))
 
-    @add_variant()
+    @add_variant(batched=True)
     async def flip(sprite, *axis: Literal["x", "y"]):
         """Flips the sprite along the specified axes."""
         for a in axis:
             if a == "x":
-                sprite = sprite[:, ::-1, :]
+                sprite = sprite[..., :, ::-1, :]
             else:
-                sprite = sprite[::-1, :, :]
+                sprite = sprite[..., ::-1, :, :]
         return sprite
 
     @add_variant()
@@ -956,23 +1020,23 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
         sprite[sprite > 255] = 255
         return sprite.astype(np.uint8)
 
-    @add_variant("alpha", "op")
+    @add_variant("alpha", "op", pointwise=True)
     async def opacity(sprite, amount: float):
         """Sets the opacity of the sprite, from 0 to 1."""
         sprite[:, :, 3] = np.multiply(sprite[:, :, 3], np.clip(amount, 0, 1), casting="unsafe")
         return sprite
 
-    @add_variant("neg")
+    @add_variant("neg", pointwise=True)
     async def negative(sprite, alpha: bool = False):
         """Inverts the sprite's RGB or RGBA values."""
         sl = slice(None, None if alpha else 3)
         sprite[..., sl] = 255 - sprite[..., sl]
         return sprite
 
-    @add_variant()
+    @add_variant(batched=True)
     async def wrap(sprite, x: int, y: int):
         """Wraps the sprite around its image box."""
-        return np.roll(sprite, (y, x), (0, 1))
+        return np.roll(sprite, (y, x), (-3, -2))
 
     @add_variant()
     async def melt(sprite, side: Optional[Literal["left", "top", "right", "bottom"]] = "bottom"):
@@ -981,11 +1045,11 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
         at_end = side in ("right", "bottom")
         if is_vertical:
             sprite = np.swapaxes(sprite, 0, 1)
-        # NOTE: I couldn't find a way to do this without at least one Python loop :/
-        for i in range(sprite.shape[0]):
-            sprite_slice = sprite[i, sprite[i, :, 3] != 0]
-            sprite[i] = np.pad(sprite_slice,
-                               ((sprite[i].shape[0] - sprite_slice.shape[0], 0)[::2 * at_end - 1], (0, 0)))
+        opaque = sprite[..., 3] != 0
+        # A stable sort keeps the opaque pixels of each row in order
+        order = np.argsort(opaque if at_end else ~opaque, axis=1, kind="stable")
+        sprite = np.take_along_axis(sprite, order[..., np.newaxis], axis=1)
+        sprite[~np.take_along_axis(opaque, order, axis=1)] = 0
         if is_vertical:
             sprite = np.swapaxes(sprite, 0, 1)
         return sprite
@@ -1012,22 +1076,22 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
         offset = ((np.sin(
             np.linspace(offset, np.pi * 2 * (frequency + offset), sprite.shape[0])) / 2) * amplitude).astype(
             int)
-        # NOTE: np.roll can't be element wise :/
-        for row in range(sprite.shape[0]):
-            sprite[row] = np.roll(sprite[row], offset[row], axis=0)
+        # Rolls each row by its own offset
+        columns = np.mod(np.arange(sprite.shape[1]) - offset[:, np.newaxis], sprite.shape[1])
+        sprite = sprite[np.arange(sprite.shape[0])[:, np.newaxis], columns]
         if axis == "y":
             sprite = np.rot90(sprite, -1)
         return sprite
 
-    @add_variant("hs")
+    @add_variant("hs", batched=True)
     async def hueshift(sprite, angle: int):
         """Shifts the hue of the sprite. 0 to 360."""
-        hsv = cv2.cvtColor(sprite[:, :, :3], cv2.COLOR_RGB2HSV)
+        hsv = cv2.cvtColor(sprite[..., :3].reshape(-1, *sprite.shape[-2:-1], 3), cv2.COLOR_RGB2HSV)
         hsv[..., 0] = np.mod(hsv[..., 0] + int(angle // 2), 180)
-        sprite[:, :, :3] = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+        sprite[..., :3] = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB).reshape(*sprite.shape[:-1], 3)
         return sprite
 
-    @add_variant("gamma", "g")
+    @add_variant("gamma", "g", pointwise=True)
     async def brightness(sprite, brightness: float):
         """Sets the brightness of the sprite."""
         sprite = sprite.astype(float)
@@ -1038,33 +1102,16 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
     @add_variant("ps")
     async def palette_snap(sprite, *, tile, wobble, renderer):
         """Snaps all the colors in the tile to the specified palette."""
-        palette_colors = np.array(renderer.palette_cache[tile.palette].convert("RGB")).reshape(-1, 3)
-        sprite_lab = cv2.cvtColor(sprite.astype(np.float32) / 255, cv2.COLOR_RGB2Lab)
-        diff_matrix = np.full((palette_colors.shape[0], *sprite.shape[:-1]), 999)
-        for i, color in enumerate(palette_colors):
-            filled_color_array = np.array([[color]]).repeat(
-                sprite.shape[0], 0).repeat(sprite.shape[1], 1)
-            filled_color_array = cv2.cvtColor(
-                filled_color_array.astype(
-                    np.float32) / 255, cv2.COLOR_RGB2Lab)
-            sprite_delta_e = np.sqrt(np.sum((sprite_lab - filled_color_array) ** 2, axis=-1))
-            diff_matrix[i] = sprite_delta_e
-        min_indexes = np.argmin(diff_matrix, 0).reshape(
-            diff_matrix.shape[1:])
-        result = np.full(sprite.shape, 0, dtype=np.uint8)
-        for i, color in enumerate(palette_colors):
-            result[:, :, :3][min_indexes == i] = color
-        result[:, :, 3] = sprite[:, :, 3]
-        return result
-
-    @add_variant("sat", "grayscale", "gscale")
+        return renderer.palette_snapper(tile.palette).snap(sprite)
+
+    @add_variant("sat", "grayscale", "gscale", batched=True)
     async def saturation(sprite, saturation: Optional[float] = 0):
         """Saturates or desaturates a sprite."""
         gray_sprite = sprite.copy()
         gray_sprite[..., :3] = (sprite[..., 0] * 0.299 + sprite[..., 1] * 0.587 + sprite[..., 2] * 0.114)[..., np.newaxis]
         return composite(gray_sprite, sprite, saturation).astype(np.uint8)
 
-    @add_variant()
+    @add_variant(pointwise=True)
     async def blank(sprite):
         """Sets a sprite to pure white."""
         sprite[:, :, :3] = 255
@@ -1081,14 +1128,15 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
         a = liquify.planet(sprite)
         return a
 
-    @add_variant("nl")
+    @add_variant("nl", batched=True)
     async def normalize_lightness(sprite):
         """Normalizes a sprite's HSL lightness, bringing the lightest value up to full brightness."""
-        arr_hls = cv2.cvtColor(sprite[:, :, :3], cv2.COLOR_RGB2HLS).astype(
-            np.float64)  # since WHEN was it HLS???? huh?????
-        max_l = np.max(arr_hls[:, :, 1])
-        arr_hls[:, :, 1] *= (255 / max_l)
-        sprite[:, :, :3] = cv2.cvtColor(arr_hls.astype(np.uint8), cv2.COLOR_HLS2RGB)  # my question still stands
+        arr_hls = cv2.cvtColor(sprite[..., :3].reshape(-1, *sprite.shape[-2:-1], 3), cv2.COLOR_RGB2HLS).astype(
+            np.float64).reshape(*sprite.shape[:-1], 3)  # since WHEN was it HLS???? huh?????
+        max_l = np.max(arr_hls[..., 1], axis=(-2, -1), keepdims=True)
+        arr_hls[..., 1] *= (255 / max_l)
+        sprite[..., :3] = cv2.cvtColor(arr_hls.astype(np.uint8).reshape(-1, *sprite.shape[-2:-1], 3),
+                                       cv2.COLOR_HLS2RGB).reshape(*sprite.shape[:-1], 3)  # my question still stands
         return sprite
 
     @add_variant("3oo", "skul", hidden=True)
@@ -1162,7 +1210,7 @@ Slices are notated as [30m([36mstart[30m/[36mstop[30m/[36mstep[30m)[0m,
         sprite[:, :, :3] = cv2.cvtColor(sprite[:, :, :3], space_conversion[direction][space])
         return sprite
 
-    @add_variant()
+    @add_variant(batched=True)
     async def threshold(sprite, r: float, g: Optional[float] = None, b: Optional[float] = None,
                         a: Optional[float] = 0.0):
         """Removes all pixels below a threshold.
@@ -1170,13 +1218,13 @@ This can be used in conjunction with blur, opacity, and additive blending to cre
 If a value is negative, it removes pixels above the threshold instead."""
         g = r if g is None else g
         b = r if b is None else b
-        im_r, im_g, im_b, im_a = np.split(sprite, 4, axis=2)
+        im_r, im_g, im_b, im_a = np.split(sprite, 4, axis=-1)
         # Could use np.logical_or, but that's much less readable for very little performance gain
         im_a[np.copysign(im_r, r) < r * 255] = 0
         im_a[np.copysign(im_g, g) < g * 255] = 0
         im_a[np.copysign(im_b, b) < b * 255] = 0
         im_a[np.copysign(im_a, a) < a * 255] = 0
-        return np.dstack((im_r, im_g, im_b, im_a))
+        return np.concatenate((im_r, im_g, im_b, im_a), axis=-1)
 
     @add_variant()
     async def blur(sprite, radius: int, gaussian: Optional[bool] = False):
@@ -1211,25 +1259,18 @@ If a value is negative, it removes pixels above the threshold instead."""
     @add_variant("filter", "fi!")
     async def filterimage(sprite, filter_url: str, absolute: Optional[bool] = None, *, tile, wobble, renderer):
         """Applies a filter image to a sprite. For information about filter images, look at the filterimage command."""
-        frames, abs_db = await renderer.bot.db.get_filter(filter_url)
-        try:
-            filter = frames[wobble]
-        except IndexError:
-            filter = frames[0]
-        filt = np.array(filter.convert("RGBA"))
-        check_size(*filt.shape[:2])
+        filt = await renderer.on_bot_loop(renderer.bot.db.get_filter(filter_url))
+        frame = wobble if wobble < len(filt.offsets) else 0
+        check_size(*filt.offsets[frame].shape[:2])
         absolute = absolute if absolute is not None else \
-            abs_db if abs_db is not None else False
-        filt = np.float32(filt)
-        filt[..., :2] -= 0x80
-        if not absolute:
-            filt[..., :2] += np.indices(filt.shape[:2]).T
-        mapped = cv2.remap(sprite, filt[..., 0], filt[..., 1],
+            filt.absolute if filt.absolute is not None else False
+        grid = filt.grid(frame, absolute)
+        scales = filt.scales[frame]
+        mapped = cv2.remap(sprite, grid[..., 0], grid[..., 1],
                            interpolation=cv2.INTER_NEAREST,
                            borderMode=cv2.BORDER_WRAP).astype(float)
-        filt /= 255
-        mapped[..., :3] *= filt[..., 2, np.newaxis]
-        mapped[..., 3] *= filt[..., 3]
+        mapped[..., :3] *= scales[..., 0, np.newaxis]
+        mapped[..., 3] *= scales[..., 1]
         return np.uint8(mapped)
 
     @add_variant()
@@ -1237,7 +1278,8 @@ If a value is negative, it removes pixels above the threshold instead."""
                      renderer):
         """Randomly displaces a sprite's pixels. An RNG seed is created using the tile's attributes if not specified."""
         if seed is None:
-            seed = abs(hash(tile))
+            # `hash()` changes between processes, and tiles are cached across restarts
+            seed = int(tile.digest()[:16], 16)
         dst = np.indices(sprite.shape[:2], dtype=np.float32)
         rng = np.random.default_rng(seed * 3 + wobble)
         displacement = rng.uniform(-distance, distance, dst.shape)
@@ -1251,3 +1293,6 @@ If a value is negative, it removes pixels above the threshold instead."""
     # --- ADD TO BOT ---
 
     bot.variants = RegexDict([(variant.pattern, variant) for variant in bot.variants])
+    bot.tile_variants = VariantDispatcher(variant for variant in bot.variants._values if variant.type != "sign")
+    bot.sign_variants = VariantDispatcher(variant for variant in bot.variants._values if variant.type == "sign")
+    bot.variant_names = [name for variant in bot.variants._values for name in variant.name if len(name)]
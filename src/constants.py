@@ -239,6 +239,7 @@ VANILLA_WORLDS = ("baba", "vanilla", "new_adv", "museum")
 VANILLA_PATHS = ("baba", "new_adv", "museum")
 
 COMBINE_MAX_FILESIZE = 5242880  # in bytes
+ATTACHMENT_CACHE_TTL = 300  # in seconds
 
 TIMEOUT_DURATION = 20
 
@@ -289,6 +290,8 @@ CHARACTER_VARIANTS = "smooth", "fluffy", "fuzzy", "polygonal", "skinny", "belt-l
 
 MACRO_LIMIT = 5000
 MACRO_ARG_LIMIT = 100
+# Number of steps kept in a macro debug trace
+MACRO_TRACE_LIMIT = 1000
 
 LETTER_IGNORE = [
     "text_you2",
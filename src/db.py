@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
+import os
 import string
-from dataclasses import dataclass
+import tempfile
+import threading
+from dataclasses import dataclass, field
 from io import BytesIO
+from pathlib import Path
 from sqlite3.dbapi2 import Row
 from typing import AsyncGenerator, Iterable, Any
 
 import re
+import aiohttp
 import asqlite
 import numpy as np
-import requests
 import tldextract as tldextract
 from PIL import Image
 
+from .sprites import LRUCache
 from .types import TilingMode
 
 from . import constants
@@ -23,10 +31,15 @@ class Database:
     """Everything relating to persistent readable & writable data."""
     conn: asqlite.Connection
     bot: None
-    filter_cache: dict[str, (Image.Image, bool)]
+    # Decoded filters by name or URL
+    filter_cache: LRUCache
+    # Every row of `tiles` by name, from newest to oldest version
+    tile_index: dict[str, list[tuple[int, TileData]]] | None
 
     def __init__(self, bot):
-        self.filter_cache = {}
+        self.filter_cache = LRUCache(bot.config["filter_cache_budget"])
+        self._session: aiohttp.ClientSession | None = None
+        self.tile_index = None
         self.bot = bot
 
     async def connect(self, db: str) -> None:
@@ -42,11 +55,22 @@ class Database:
         print("Initialized database connection.")
         await self.create_tables()
         print("Verified database tables.")
+        await self.load_tile_index()
+        print(f"Indexed {len(self.tile_index)} tiles.")
 
     async def close(self) -> None:
         """Teardown."""
         if hasattr(self, "conn"):
             await self.conn.close()
+        if self._session is not None:
+            await self._session.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """An HTTP session that's shared between requests, so that connections are pooled."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10, sock_connect=3))
+        return self._session
 
     async def create_tables(self) -> None:
         """Creates tables in the database according to a schema in code.
@@ -184,11 +208,24 @@ class Database:
                 '''
             )
 
+    async def load_tile_index(self) -> None:
+        """Loads the tiles table into memory, so that looking up tiles doesn't need a query.
+
+        This has to be called again whenever the table changes.
+        The new index replaces the old one all at once, so lookups never see it half-built.
+        """
+        index = {}
+        for row in await self.conn.fetchall('SELECT * FROM tiles ORDER BY version DESC;'):
+            index.setdefault(row["name"], []).append((row["version"], TileData.from_row(row)))
+        self.tile_index = index
+
     async def tile(self, name: str, *, maximum_version: int = 1000) -> TileData | None:
         """Convenience method to fetch a single thing of tile data.
 
         Returns None on failure.
         """
+        if self.tile_index is not None:
+            return next((data for version, data in self.tile_index.get(name, ()) if version <= maximum_version), None)
         row = await self.conn.fetchone(
             '''
 			SELECT * FROM tiles
@@ -206,6 +243,12 @@ class Database:
 
         Returns None on failure.
         """
+        if self.tile_index is not None:
+            for name in names:
+                data = next((data for version, data in self.tile_index.get(name, ()) if version < maximum_version), None)
+                if data is not None:
+                    yield data
+            return
         async with self.conn.cursor() as cur:
             for name in names:
                 await cur.execute(
@@ -241,47 +284,168 @@ class Database:
             (3, 3)
         )
 
-    async def get_filter(self, url: str):
+    async def get_filter(self, url: str) -> Filter:
         """Get a filter from the database."""
-        if url not in self.filter_cache:
-            async with (self.conn.cursor() as cur):
-                await cur.execute("SELECT url, absolute FROM filterimages WHERE name == ?;", url)
-                result = await cur.fetchone()
-                if result is None:
-                    assert "catbox.moe/" in url, f"Filter `{url}` wasn't found in the database!"
-                    extracted = tldextract.extract(url)
-                    print(extracted)
-                    assert extracted.domain == "catbox" \
-                           and extracted.suffix == "moe", \
-                           "Please only use catbox.moe for filters."
-                    result = f"https://{url}"
-                    absolute = None
-                else:
-                    result, absolute = result
-                try:
-                    filter_headers = requests.head(result, timeout=3).headers
-                except requests.exceptions.ConnectionError:
-                    raise AssertionError(f"Filter `{url}` isn't a valid URL (or didn't respond in time)!")
-                assert int(
-                    filter_headers.get("content-length", 0)) < constants.FILTER_MAX_SIZE, f"Filter `{url}` is too big!"
-                buffer = requests.get(result, stream=True).raw.read()
-                try:
-                    with Image.open(BytesIO(buffer)) as im:
-                        frames = []
-                        frame_count = getattr(im, "n_frames", 1)
-                        assert frame_count <= 3, "Too many frames in the filter (max is 3)!"
-                        for i in range(0, frame_count):
-                            im.seek(i)
-                            frames.append(im.copy().convert("RGBA"))
-                        final = frames, absolute
-                        self.filter_cache[url] = final
-                        return final
-                except IOError:
-                    raise AssertionError(f"Filter `{url}` couldn't be parsed as an image!")
-        return self.filter_cache[url]
+        cached = self.filter_cache.lookup(url)
+        if cached is not None:
+            return cached
+        async with (self.conn.cursor() as cur):
+            await cur.execute("SELECT url, absolute FROM filterimages WHERE name == ?;", url)
+            result = await cur.fetchone()
+        if result is None:
+            assert "catbox.moe/" in url, f"Filter `{url}` wasn't found in the database!"
+            extracted = tldextract.extract(url)
+            print(extracted)
+            assert extracted.domain == "catbox" \
+                   and extracted.suffix == "moe", \
+                   "Please only use catbox.moe for filters."
+            result = f"https://{url}"
+            absolute = None
+        else:
+            result, absolute = result
+        buffer = await self.fetch_filter(url, result)
+        try:
+            final = await asyncio.to_thread(Filter.decode, buffer, absolute)
+        except IOError:
+            raise AssertionError(f"Filter `{url}` couldn't be parsed as an image!")
+        self.filter_cache.store(url, final, final.nbytes)
+        return final
+
+    async def forget_filter(self, name: str):
+        """Drops everything that was made with a filter, once it's been registered, replaced or deleted.
+
+        Processed tiles and finished renders are keyed by the filter's name rather than its contents,
+        so they have to go too.
+        """
+        self.filter_cache.discard(name)
+        await asyncio.to_thread(self.bot.renderer.tile_cache.invalidate)
+        await self.bot.renderer.render_cache.clear()
 
+    async def fetch_filter(self, name: str, url: str) -> bytes:
+        """Downloads a filter image.
 
-@dataclass
+        Images are kept on disk, and only downloaded again if the server says they've changed since.
+        """
+        directory = Path(self.bot.config["filter_cache_dir"])
+        key = hashlib.sha1(url.encode()).hexdigest()
+        data_path, meta_path = directory / f"{key}.bin", directory / f"{key}.json"
+        cached = await asyncio.to_thread(self.read_cached_filter, data_path, meta_path)
+        headers = {}
+        if cached is not None:
+            meta, data = cached
+            if meta.get("etag") is not None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified") is not None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                if resp.status == 304 and cached is not None:
+                    return cached[1]
+                buffer = await self.read_filter(resp, name)
+                etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if cached is not None:
+                return cached[1]
+            raise AssertionError(f"Filter `{name}` isn't a valid URL (or didn't respond in time)!")
+        if etag is not None or last_modified is not None:
+            meta = {"url": url, "etag": etag, "last_modified": last_modified,
+                    "sha1": hashlib.sha1(buffer).hexdigest()}
+            await asyncio.to_thread(self.write_cached_filter, data_path, meta_path, buffer, meta)
+        return buffer
+
+    @staticmethod
+    async def read_filter(resp: aiohttp.ClientResponse, name: str) -> bytes:
+        """Reads a filter image from a response, stopping as soon as it's too big."""
+        resp.raise_for_status()
+        assert (resp.content_length or 0) < constants.FILTER_MAX_SIZE, f"Filter `{name}` is too big!"
+        buffer = bytearray()
+        async for chunk in resp.content.iter_chunked(2 ** 16):
+            buffer += chunk
+            assert len(buffer) < constants.FILTER_MAX_SIZE, f"Filter `{name}` is too big!"
+        return bytes(buffer)
+
+    @staticmethod
+    def read_cached_filter(data_path: Path, meta_path: Path) -> tuple[dict, bytes] | None:
+        """Reads a downloaded filter image and its headers, or returns None if they're missing, corrupt or don't match."""
+        try:
+            meta = json.loads(meta_path.read_text())
+            data = data_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or meta.get("sha1") != hashlib.sha1(data).hexdigest():
+            return None
+        return meta, data
+
+    @staticmethod
+    def write_cached_filter(data_path: Path, meta_path: Path, data: bytes, meta: dict):
+        """Saves a downloaded filter image and its headers.
+
+        Each file is written next to where it goes and moved into place once it's done,
+        so that a crash midway leaves a pair that doesn't match instead of a truncated one.
+        """
+        try:
+            data_path.parent.mkdir(parents=True, exist_ok=True)
+            for path, contents in ((data_path, data), (meta_path, json.dumps(meta).encode())):
+                fd, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(contents)
+                    os.replace(temp, path)
+                except BaseException:
+                    os.unlink(temp)
+                    raise
+        except OSError:
+            # The disk copy is only a cache, so the filter can still be used without it
+            pass
+
+
+@dataclass(slots=True)
+class Filter:
+    """A filter image, converted into what the filter variant remaps sprites with."""
+    # The UV offset of each pixel of each frame, as float32
+    offsets: list[np.ndarray]
+    # The brightness and alpha of each pixel of each frame, from 0 to 1
+    scales: list[np.ndarray]
+    absolute: bool | None
+    relative: list[np.ndarray | None] = field(default_factory=list)
+    # Filters are shared between render threads, which fill in `relative` as they need it
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @classmethod
+    def decode(cls, buffer: bytes, absolute: bool | None) -> Filter:
+        offsets, scales = [], []
+        with Image.open(BytesIO(buffer)) as im:
+            frame_count = getattr(im, "n_frames", 1)
+            assert frame_count <= 3, "Too many frames in the filter (max is 3)!"
+            for i in range(0, frame_count):
+                im.seek(i)
+                frame = np.float32(np.array(im.convert("RGBA")))
+                offsets.append(frame[..., :2] - 0x80)
+                scales.append(frame[..., 2:] / 255)
+        for array in (*offsets, *scales):
+            array.flags.writeable = False
+        return cls(offsets, scales, absolute, [None] * len(offsets))
+
+    @property
+    def nbytes(self) -> int:
+        # Leave room for the relative grids
+        return sum(2 * offsets.nbytes for offsets in self.offsets) + sum(scales.nbytes for scales in self.scales)
+
+    def grid(self, frame: int, absolute: bool) -> np.ndarray:
+        """Gets the remap grid of a frame, which is relative to each pixel's position unless it's absolute."""
+        if absolute:
+            return self.offsets[frame]
+        with self._lock:
+            grid = self.relative[frame]
+            if grid is None:
+                offsets = self.offsets[frame]
+                grid = offsets + np.indices(offsets.shape[:2], dtype=np.float32).T
+                grid.flags.writeable = False
+                self.relative[frame] = grid
+            return grid
+
+
+@dataclass(slots=True)
 class TileData:
     name: str
     sprite: str
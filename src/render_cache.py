@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, TypeVar
+
+import numpy as np
+from PIL import Image
+
+from .types import RenderContext
+
+T = TypeVar("T")
+
+# Fields of a render context that don't change what it renders to
+IGNORED_FIELDS = {"ctx", "out", "extra_out", "macros", "tile_cache", "do_embed"}
+
+
+class RenderCache:
+    """A content-addressed cache of finished renders, stored on disk.
+
+    Renders are keyed by their fully parsed tile grid and render options,
+    and evicted least recently used first once they take up more than `budget` bytes.
+    Identical renders that are requested while one is in progress wait for it, instead of starting their own.
+    """
+
+    def __init__(self, directory: str, budget: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        # Bumped whenever the cache is cleared, so that renders that started before then aren't saved
+        self.generation = 0
+        self._in_flight: dict[str, asyncio.Future[tuple[bytes, bytes | None]]] = {}
+        self._files: OrderedDict[str, int] = OrderedDict()
+        for path in sorted(self.directory.glob("*.*"), key=os.path.getmtime):
+            self._files[path.name] = path.stat().st_size
+        self.size = sum(self._files.values())
+
+    @staticmethod
+    def key(grid: list[list[list[list]]], ctx: RenderContext) -> str:
+        """Hashes everything that goes into a render."""
+        h = hashlib.blake2b(digest_size=20)
+        for field in dataclasses.fields(ctx):
+            if field.name in IGNORED_FIELDS:
+                continue
+            value = getattr(ctx, field.name)
+            if field.name in ("before_images", "background_images") and value:
+                for image in value:
+                    if isinstance(image, Image.Image):
+                        h.update(f"{image.mode}{image.size}".encode())
+                        h.update(image.tobytes())
+                    else:
+                        h.update(repr(image).encode())
+                continue
+            h.update(f"{field.name}={value!r};".encode())
+        for tile in np.array(grid, dtype=object).flatten():
+            if tile.empty:
+                h.update(b".")
+                continue
+            h.update(tile.digest().encode())
+            h.update(repr((tile.wobble_frames, [(type(var).__name__, var.args, var.kwargs)
+                                                for var in tile.variants["post"]])).encode())
+        h.update(repr(np.array(grid, dtype=object).shape).encode())
+        return h.hexdigest()
+
+    async def fetch(self, key: str, ctx: RenderContext, render: Callable[[], Awaitable[T]]) -> T | None:
+        """Fills the context's outputs from the cache if possible, otherwise awaits `render()` and caches its output.
+
+        Returns what `render()` returned, or None if it didn't have to run.
+        """
+        names = [name for name in self.names(key, ctx) if name is not None]
+        if all(name in self._files for name in names):
+            for name in names:
+                self._files.move_to_end(name)
+            try:
+                outputs = await asyncio.to_thread(self.read, names)
+            except OSError:
+                # It was evicted or deleted while it was being read
+                for name in names:
+                    self.size -= self._files.pop(name, 0)
+            else:
+                self.hits += 1
+                self.fill(ctx, *outputs)
+                return None
+        while key in self._in_flight:
+            future = self._in_flight[key]
+            try:
+                outputs = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The render being waited on was cancelled rather than this one, so try again
+                continue
+            self.waits += 1
+            self.fill(ctx, *outputs)
+            return None
+        self.misses += 1
+        generation = self.generation
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await render()
+            outputs = ctx.out.getvalue(), None if ctx.extra_out is None else ctx.extra_out.getvalue()
+            future.set_result(outputs)
+            # It stays in flight until it's on disk, so that identical renders don't start in the meantime
+            for name, data in zip(names, outputs):
+                await self.store(name, data, generation)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as err:
+            if not future.done():
+                future.set_exception(err)
+                # Mark it as retrieved, since nobody might be waiting on it
+                future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+        return result
+
+    def names(self, key: str, ctx: RenderContext) -> tuple[str, str | None]:
+        return f"{key}.{ctx.image_format}", f"{key}.zip" if ctx.extra_out is not None else None
+
+    @staticmethod
+    def fill(ctx: RenderContext, out: bytes, extra_out: bytes | None = None):
+        ctx.out.write(out)
+        ctx.out.seek(0)
+        if extra_out is not None and ctx.extra_out is not None:
+            ctx.extra_out.write(extra_out)
+            ctx.extra_out.seek(0)
+
+    def read(self, names: list[str]) -> list[bytes]:
+        """Reads cached files, marking them as recently used on disk too. Blocks, so it's run in a thread."""
+        outputs = []
+        for name in names:
+            path = self.directory / name
+            os.utime(path)
+            outputs.append(path.read_bytes())
+        return outputs
+
+    def remove(self, names: list[str]):
+        """Deletes cached files. Blocks, so it's run in a thread."""
+        for name in names:
+            (self.directory / name).unlink(missing_ok=True)
+
+    async def store(self, name: str, data: bytes, generation: int):
+        """Saves a file to the cache, evicting the least recently used ones if it goes over budget.
+
+        The files are written and deleted in a thread, but the index is only changed on the event loop.
+        """
+        if generation != self.generation:
+            return
+        try:
+            await asyncio.to_thread((self.directory / name).write_bytes, data)
+        except OSError:
+            # The render was still sent, it just won't be cached
+            return
+        if generation != self.generation:
+            await asyncio.to_thread(self.remove, [name])
+            return
+        self.size += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        evicted = []
+        while self.size > self.budget and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            evicted.append(name)
+            self.size -= size
+        if evicted:
+            await asyncio.to_thread(self.remove, evicted)
+
+    async def clear(self):
+        self.generation += 1
+        names = list(self._files)
+        self._files.clear()
+        self.size = 0
+        await asyncio.to_thread(self.remove, names)
+
+    def stats(self) -> str:
+        return (f"{len(self._files)} files, {self.size / 2 ** 20:.1f} / {self.budget / 2 ** 20:.1f} MiB\n"
+                f"{self.hits} hits, {self.misses} misses, {self.waits} waited on an identical render")
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import sys
+import threading
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+PACK_MAGIC = b"RICPACK1"
+# Magic, then the offset and length of the JSON index at the end of the file
+PACK_HEADER = struct.Struct("<8sQQ")
+
+
+class SpritePack:
+    """A memory-mapped file of raw RGBA sprites, built from a sprite directory by `build_pack`.
+
+    Sprites are indexed by source and file name (e.g. `baba_0_1`),
+    and are sliced from the file without copying.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+        self.built = os.path.getmtime(path)
+        magic, index_offset, index_length = PACK_HEADER.unpack_from(self.data)
+        assert magic == PACK_MAGIC, f"`{path}` isn't a sprite pack."
+        assert index_offset + index_length <= len(self.data), f"`{path}` is truncated."
+        index = json.loads(bytes(self.data[index_offset:index_offset + index_length]))
+        self.root = index["root"]
+        # Replaced rather than changed in place, since render threads read it without a lock
+        self.sprites: dict[tuple[str, str], tuple[int, int, int]] = {
+            tuple(key.split("/", 1)): tuple(value) for key, value in index["sprites"].items()
+        }
+        for offset, height, width in self.sprites.values():
+            assert PACK_HEADER.size <= offset and offset + height * width * 4 <= index_offset, \
+                f"`{path}` is truncated."
+
+    def __len__(self) -> int:
+        return len(self.sprites)
+
+    def key(self, path: str) -> tuple[str, str] | None:
+        """Gets the index key of a sprite path, if it's in the packed directory."""
+        source, _, name = path.removeprefix(self.root + "/").partition("/")
+        if not path.startswith(self.root + "/") or not name.endswith(".png") or "/" in name:
+            return None
+        return source, name[:-4]
+
+    def get(self, path: str) -> np.ndarray | None:
+        entry = self.sprites.get(self.key(path))
+        if entry is None:
+            return None
+        offset, height, width = entry
+        return self.data[offset:offset + height * width * 4].reshape((height, width, 4))
+
+    def discard_stale(self, prefix: str):
+        """Forgets packed sprites under the prefix that changed since the pack was built,
+        so that they're read from disk instead.
+
+        This checks every file under the prefix, so it shouldn't be called on the event loop.
+        """
+        def stale(key: tuple[str, str]) -> bool:
+            path = f"{self.root}/{key[0]}/{key[1]}.png"
+            return path.startswith(prefix) and (not os.path.exists(path) or os.path.getmtime(path) > self.built)
+
+        self.sprites = {key: value for key, value in self.sprites.items() if not stale(key)}
+
+
+def build_pack(root: str = "data/sprites", out: str = "data/sprites.pack") -> int:
+    """Packs every sprite under a directory into a sprite pack, returning how many there were.
+
+    The pack is written next to `out` and moved into place once it's done, so an open one isn't disturbed.
+    """
+    sprites = {}
+    temp = f"{out}.tmp"
+    with open(temp, "wb") as f:
+        f.write(bytes(PACK_HEADER.size))
+        for path in sorted(Path(root).glob("*/*.png")):
+            try:
+                with Image.open(path) as im:
+                    sprite = np.array(im.convert("RGBA"))
+            except OSError:
+                continue
+            sprites[f"{path.parent.name}/{path.stem}"] = (f.tell(), *sprite.shape[:2])
+            f.write(sprite.tobytes())
+        index = json.dumps({"root": root, "sprites": sprites}).encode()
+        index_offset = f.tell()
+        f.write(index)
+        f.seek(0)
+        f.write(PACK_HEADER.pack(PACK_MAGIC, index_offset, len(index)))
+    os.replace(temp, out)
+    return len(sprites)
+
+
+class LRUCache:
+    """A least-recently-used cache that's bounded by the size of its values in bytes.
+
+    Once they take up more than `budget` bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: str) -> Any | None:
+        """Returns the value stored under a key, or None, counting it as a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def store(self, key: str, value: Any, nbytes: int):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = value, nbytes
+            self.size += nbytes
+            while self.size > self.budget and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def discard(self, key: str):
+        """Drops the entry stored under a key, if there is one."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def invalidate(self, prefix: str = ""):
+        """Drops every entry whose key starts with the prefix, or all of them if it's empty."""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self.size -= self._entries.pop(key)[1]
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        return (f"{len(self)} entries, {self.size / 2 ** 20:.1f} / {self.budget / 2 ** 20:.1f} MiB\n"
+                f"{self.hits} hits, {self.misses} misses "
+                f"({self.hits / total if total else 0:.1%} hit rate), {self.evictions} evictions")
+
+
+class SpriteCache(LRUCache):
+    """A cache of decoded sprites, shared between renders.
+
+    Sprites are stored as read-only RGBA arrays, keyed by path.
+    If a sprite pack is loaded, sprites in it are sliced straight from it instead.
+    """
+
+    def __init__(self, budget: int):
+        super().__init__(budget)
+        self.pack: SpritePack | None = None
+        self.pack_hits = 0
+
+    def load_pack(self, path: str) -> bool:
+        """Loads the sprite pack at a path, returning whether there was a usable one.
+
+        If it's corrupt, sprites are read from disk instead.
+        """
+        self.pack = None
+        if not os.path.exists(path):
+            return False
+        try:
+            self.pack = SpritePack(path)
+        except (OSError, ValueError, KeyError, TypeError, AssertionError, struct.error) as err:
+            warnings.warn(f"Couldn't load the sprite pack at `{path}`, so sprites will be read from disk: {err!r}")
+            return False
+        return True
+
+    def get(self, path: str) -> np.ndarray:
+        """Returns the sprite at a path, opening it if it isn't cached.
+
+        Raises FileNotFoundError if it doesn't exist.
+        """
+        pack = self.pack
+        if pack is not None:
+            sprite = pack.get(path)
+            if sprite is not None:
+                self.pack_hits += 1
+                return sprite
+        sprite = self.lookup(path)
+        if sprite is None:
+            with Image.open(path) as im:
+                sprite = np.array(im.convert("RGBA"))
+            sprite.flags.writeable = False
+            self.store(path, sprite, sprite.nbytes)
+        return sprite
+
+    def invalidate(self, prefix: str = ""):
+        """Drops every cached sprite whose path starts with the prefix, or all of them if it's empty.
+
+        Packed sprites are only dropped if their file has changed since the pack was built.
+        """
+        super().invalidate(prefix)
+        if self.pack is not None:
+            self.pack.discard_stale(prefix)
+
+    def stats(self) -> str:
+        stats = super().stats()
+        if self.pack is not None:
+            stats += f"\nPack: {len(self.pack)} sprites, {self.pack_hits} hits"
+        return stats
+
+
+class TileCache(LRUCache):
+    """A cache of the frames of fully processed tiles, shared between renders and keyed by `Tile.digest`.
+
+    If given a directory, frames are also saved there, and survive restarts.
+    """
+
+    def __init__(self, budget: int, directory: str | None = None):
+        super().__init__(budget)
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> list[np.ndarray | None] | None:
+        frames = self.lookup(key)
+        if frames is None and self.directory is not None:
+            try:
+                with np.load(f"{self.directory}/{key}.npz") as data:
+                    frames = [data[str(i)] if str(i) in data else None for i in range(3)]
+            except (OSError, ValueError):
+                return None
+            self.store(key, frames, persist=False)
+        return None if frames is None else list(frames)
+
+    def store(self, key: str, frames: list[np.ndarray | None], persist: bool = True):
+        frames = list(frames)
+        for frame in frames:
+            if frame is not None:
+                frame.flags.writeable = False
+        super().store(key, frames, sum(frame.nbytes for frame in frames if frame is not None))
+        if persist and self.directory is not None:
+            np.savez(f"{self.directory}/{key}.npz", **{str(i): frame for i, frame in enumerate(frames) if frame is not None})
+
+    def invalidate(self, prefix: str = ""):
+        super().invalidate(prefix)
+        if self.directory is not None:
+            for path in Path(self.directory).glob(f"{prefix}*.npz"):
+                path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    print(f"Packed {build_pack(*sys.argv[1:3])} sprites.")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 from dataclasses import dataclass, field
 
 from typing import Literal, Optional
@@ -8,12 +9,12 @@ import numpy as np
 
 from src.types import TilingMode
 from . import errors, constants
-from .cogs.variants import parse_signature
+from .cogs.variants import VariantDispatcher
 from .db import TileData
-from .types import Variant, Context, RegexDict
+from .types import Variant, Context
 
 
-def parse_variants(bot, possible_variants: RegexDict[Variant], raw_variants: list[str],
+def parse_variants(bot, possible_variants: VariantDispatcher, raw_variants: list[str],
                    name=None, possible_variant_names=None, macros=None):
     if macros is None:
         macros = {}
@@ -30,12 +31,9 @@ def parse_variants(bot, possible_variants: RegexDict[Variant], raw_variants: lis
             raw_variants[i:i] = macro.split(":")  # Extend at index i
             continue
         try:
-            final_variant = possible_variants[raw_variant]
-            var_type = final_variant.type
-            variant_args = [g for g in re.fullmatch(final_variant.pattern, raw_variant).groups() if g is not None]
-            final_args = parse_signature(variant_args, final_variant.signature)
-            out[var_type] = out.get(var_type, [])
-            out[var_type].append(final_variant(*final_args))
+            final_variant = possible_variants.parse(raw_variant)
+            out[final_variant.type] = out.get(final_variant.type, [])
+            out[final_variant.type].append(final_variant)
         except KeyError:
             for variant_name in possible_variant_names:
                 if raw_variant.startswith(variant_name) and len(variant_name):
@@ -171,6 +169,28 @@ class Tile:
                      hash(tuple(var for var in self.variants["tile"] if var.hashed)),
                      self.custom_color, self.palette))
 
+    def digest(self) -> str:
+        """Hashes everything that goes into the tile's frames.
+
+        Unlike `hash()`, this is stable between processes, so it can be used to cache tiles across restarts.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        if type(self.sprite) is tuple:
+            sprite = self.sprite
+        else:
+            sprite = self.sprite.shape
+            h.update(np.ascontiguousarray(self.sprite).data)
+        variants = (
+            [(type(var).__name__, var.args, var.kwargs) for var in self.variants["sprite"]],
+            [(type(var).__name__, var.args, var.kwargs) for var in self.variants["tile"] if var.hashed]
+        )
+        h.update(repr((self.name, sprite, self.frame, self.empty, self.custom, self.color,
+                       self.style, self.palette, self.overlay, self.hue,
+                       self.gamma, self.saturation, self.filterimage,
+                       self.palette_snapping, self.normalize_gamma, self.altered_frame,
+                       variants, self.custom_color)).encode())
+        return h.hexdigest()
+
     @classmethod
     async def prepare(cls, possible_variants, tile: TileSkeleton, tile_data_cache: dict[str, TileData], grid,
                       position: tuple[int, int, int, int], tile_borders: bool = False, ctx: Context = None):
@@ -178,29 +198,31 @@ class Tile:
             return cls(name="<empty>")
         name = tile.name
         metadata = None
+        # Skeletons are shared between timesteps, so each tile gets its own variant lists to add to
+        variants = {kind: list(kind_variants) for kind, kind_variants in tile.variants.items()}
         try:
             metadata = tile_data_cache[name]
             style = constants.TEXT_TYPES[metadata.text_type]
             value = cls(name=tile.name, sprite=(metadata.source, metadata.sprite), tiling=metadata.tiling,
-                        color=metadata.active_color, variants=tile.variants, empty=False, style=style,
+                        color=metadata.active_color, variants=variants, empty=False, style=style,
                         palette=tile.palette)
             if metadata.tiling == TilingMode.TILING or metadata.tiling == TilingMode.DIAGONAL_TILING:
                 handle_tiling(value, grid, position, tile_borders=tile_borders)
         except KeyError:
             if name[:5] == "text_":
-                value = cls(name=name, tiling=TilingMode.NONE, variants=tile.variants, empty=False, custom=True,
+                value = cls(name=name, tiling=TilingMode.NONE, variants=variants, empty=False, custom=True,
                             palette=tile.palette)
             elif name[:5] == "char_" and ctx is not None:  # allow external calling for potential future things?
                 seed = int(name[5:]) if re.fullmatch(r'-?\d+', name[5:]) else name[5:]
                 character = ctx.bot.generator.generate(seed=seed)
                 color = character[1]["color"]
-                value = cls(name=name, tiling=TilingMode.CHARACTER, variants=tile.variants, empty=False, custom=True,
+                value = cls(name=name, tiling=TilingMode.CHARACTER, variants=variants, empty=False, custom=True,
                             sprite=character[0], color=color, palette=tile.palette)
             elif name[:6] == "cchar_" and ctx is not None:  # allow external calling for potential future things? again?
                 customid = int(name[6:]) if re.fullmatch(r'-?\d+', name[6:]) else name[6:]
                 character = ctx.bot.generator.generate(customid=customid)
                 color = character[1]["color"]
-                value = cls(name=name, tiling=TilingMode.CHARACTER, variants=tile.variants, empty=False, custom=True,
+                value = cls(name=name, tiling=TilingMode.CHARACTER, variants=variants, empty=False, custom=True,
                             sprite=character[0], color=color, palette=tile.palette)
             else:
                 raise errors.TileNotFound(name)
@@ -251,11 +251,52 @@ class Slice:
     def __init__(self, *args):
         self.slice = slice(*args)
 
+    def __repr__(self):
+        # Goes into tile digests, so it can't fall back to the object's address
+        return f"Slice({self.slice.start!r}, {self.slice.stop!r}, {self.slice.step!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Slice):
+            return NotImplemented
+        return (self.slice.start, self.slice.stop, self.slice.step) == \
+            (other.slice.start, other.slice.stop, other.slice.step)
+
+    def __hash__(self):
+        return hash((self.slice.start, self.slice.stop, self.slice.step))
+
+MACRO_ARGUMENT_PATTERN = re.compile(r"\$(-?\d+|#|!)")
+
+
 @dataclass
 class Macro:
     value: str
     description: str
     author: int
+    template: tuple[list[str], list[int | str], int] | None = field(default=None, init=False, repr=False, compare=False)
+    """The value split into literal text and the arguments between it, along with how many numbered arguments there are."""
+
+    def __post_init__(self):
+        self.compile()
+
+    def compile(self):
+        """Splits the value into a template, so that arguments can be filled in with a join.
+
+        Filling in `$#` first can make a different argument out of the text in front of it (e.g. `$1$#`),
+        so values where that could happen don't get a template, and are searched for arguments every time.
+        """
+        literals, slots = [], []
+        position = 0
+        for match in MACRO_ARGUMENT_PATTERN.finditer(self.value):
+            literals.append(self.value[position:match.start()])
+            slot = match.group(1)
+            if slot == "#" and (literals[-1].endswith(("$", "$-"))
+                                or not len(literals[-1]) and len(slots) and isinstance(slots[-1], int)):
+                self.template = None
+                return
+            slots.append(slot if slot in ("#", "!") else int(slot))
+            position = match.end()
+        literals.append(self.value[position:])
+        self.template = literals, slots, sum(isinstance(slot, int) for slot in slots)
 
 
 @dataclass
@@ -307,7 +348,6 @@ class RenderContext:
     macros: dict = field(default_factory=lambda: {})
     tileborder: bool = False
     gscale: int = 1
-    sprite_cache: dict = field(default_factory=lambda: {})
     tile_cache: dict = field(default_factory=lambda: {})
     letters: bool = False
 
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# How long to wait before checking again, if a task is overdue while another one is running
+ALARM_RETRY = 0.05
+
+# The deadlines of tasks guarded by `interrupt_after`
+_alarms: dict[asyncio.Task, float] = {}
+
+
+def _arm():
+    if not _alarms:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        return
+    signal.setitimer(signal.ITIMER_REAL, max(min(_alarms.values()) - time.monotonic(), ALARM_RETRY))
+
+
+def _on_alarm(_signum, _frame):
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task in _alarms and _alarms[task] <= time.monotonic():
+        del _alarms[task]
+        _arm()
+        raise AssertionError("The command took too long and was timed out.")
+    _arm()
+
+
+@contextlib.contextmanager
+def interrupt_after(deadline: float | None):
+    """Interrupts the current task if it's still running on the event loop past the deadline.
+
+    Some work can't be handed to the render pool, since it holds the GIL until it's done,
+    like a regular expression that backtracks. `re` checks for signals, so a SIGALRM can still break into it.
+    There's only one alarm, so every guarded task shares it, and it only ever interrupts the task that's overdue.
+    """
+    task = asyncio.current_task()
+    if deadline is None or task is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    _alarms[task] = deadline
+    signal.signal(signal.SIGALRM, _on_alarm)
+    _arm()
+    try:
+        yield
+    finally:
+        _alarms.pop(task, None)
+        _arm()
+
+
+class RenderJob:
+    """A handle to a job running on the render pool.
+
+    Workers can't be interrupted from the outside,
+    so long-running jobs should call `check()` between units of work.
+    """
+
+    def __init__(self, deadline: float | None = None):
+        self.deadline = deadline
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self.deadline is not None and time.monotonic() > self.deadline)
+
+    def check(self):
+        """Raises if the job was cancelled or ran past its deadline."""
+        if self.cancelled:
+            raise asyncio.TimeoutError()
+
+
+class RenderPool:
+    """Runs blocking render work off of the event loop."""
+
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+
+    async def run(self, fn: Callable[..., T], *args, deadline: float | None = None, **kwargs) -> T:
+        """Runs `fn(*args, job=..., **kwargs)` on a worker thread.
+
+        If the awaiting task is cancelled or the deadline (from `time.monotonic()`) passes, the job is flagged,
+        and the worker bails out at its next `check()`.
+        """
+        job = RenderJob(deadline)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(fn, *args, job=job, **kwargs))
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except BaseException:
+            job.cancel()
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)